@@ -5,10 +5,17 @@ import tempfile
 import logging
 import traceback
 
-from ocr import extract_text_by_pages, OCRExtractionError
-from envoice_processor import process_multiple_invoices
+from ocr import iter_page_results, iter_text_by_pages, MemoryBudget, OCRExtractionError, OCRSettings
+from disk_cache import DiskCache, default_cache_dir, file_sha256
+from envoice_processor import FUEL_TABLE_COLUMNS, process_multiple_invoices
+from llm_extractor import (
+    INVOICE_BATCH_TOKENS,
+    MAX_CONCURRENT_REQUESTS,
+    llm_cache_stats,
+    parse_failure_stats,
+)
 from envoice_excel_export import export_invoices_to_excel
-from deed_validator import process_deed
+from deed_validator import process_deed_stream
 from deed_excel_exporter import export_deeds_to_excel, flatten_deed
 from catastro_demo.catastro_client import CatastroClient
 
@@ -19,6 +26,12 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Caché OCR persistente: las re-subidas del mismo PDF no se vuelven a procesar
+ocr_cache = DiskCache(os.path.join(default_cache_dir(), "ocr_cache.sqlite"))
+
+# Estado por chunk de las escrituras: reprocesar reintenta solo los fallidos
+deed_checkpoints = DiskCache(os.path.join(default_cache_dir(), "deed_checkpoints.sqlite"))
+
 # ---------------------------
 # UI
 # ---------------------------
@@ -124,10 +137,26 @@ def server(input, output, session):
             nombre = fileinfo["name"]
 
             try:
-                pages = extract_text_by_pages(path)
-                logger.info("OCR completado")
-                facturas = process_multiple_invoices(pages)
-                logger.info("Extracción LLM completada")
+                # OCR y LLM solapados: cada página se envía al modelo
+                # mientras se extraen las siguientes. PageResult aporta el
+                # hash de imagen para detectar páginas escaneadas dos veces
+                # y, en PDFs digitales, las filas de la tabla de consumos.
+                pages = iter_page_results(
+                    path,
+                    settings=OCRSettings(table_columns=FUEL_TABLE_COLUMNS),
+                    cache=ocr_cache,
+                    prefetch=2
+                )
+                facturas = process_multiple_invoices(
+                    pages,
+                    max_in_flight=MAX_CONCURRENT_REQUESTS,
+                    batch_tokens=INVOICE_BATCH_TOKENS
+                )
+                logger.info(
+                    f"OCR + extracción LLM completados "
+                    f"(caché OCR: {ocr_cache.stats()}, caché LLM: {llm_cache_stats()}, "
+                    f"parseo por modo: {parse_failure_stats()})"
+                )
 
                 for f in facturas:
                     f["archivo_origen"] = nombre
@@ -172,9 +201,20 @@ def server(input, output, session):
         path = fileinfo["datapath"]
         nombre = fileinfo["name"]
 
-        pages = extract_text_by_pages(path)
+        # Escrituras de cientos de páginas: liberar cada página al terminarla
+        pages = iter_text_by_pages(path, cache=ocr_cache, memory=MemoryBudget())
 
-        result = process_deed(pages)
+        result = process_deed_stream(
+            pages,
+            max_in_flight=MAX_CONCURRENT_REQUESTS,
+            checkpoint_store=deed_checkpoints,
+            document_id=file_sha256(path)
+        )
+        logger.info(
+            f"OCR + extracción LLM completados "
+            f"(caché OCR: {ocr_cache.stats()}, caché LLM: {llm_cache_stats()}, "
+            f"parseo por modo: {parse_failure_stats()})"
+        )
 
         result["archivo_origen"] = nombre
 
@@ -1,30 +1,33 @@
 import re
 
+from entity_scanner import CATASTRAL_REF, is_valid_catastral_ref, scan_entities
+
 # ---------------------------------------------------------
-# Patrón oficial de referencia catastral estándar (20 caracteres):
-# 7 dígitos + 1 letra + 7 dígitos + 2 letras
+# Referencia catastral completa (20 caracteres):
+# parcela (14) + cargo (4 dígitos) + 2 caracteres de control
 # ---------------------------------------------------------
-CATASTRAL_PATTERN = re.compile(r"\b\d{7}[A-Z]\d{7}[A-Z]{2}\b")
+CATASTRAL_PATTERN = re.compile(rf"\b{CATASTRAL_REF}\b")
 
-# Extrae todas las referencias catastrales válidas encontradas en un texto completo.
+# Extrae todas las referencias catastrales encontradas en un texto completo,
+# incluidas las de control incorrecto (posibles errores de OCR).
 def extract_catastral_refs_regex(text):
-    text = text.upper()
-    return list(set(re.findall(CATASTRAL_PATTERN, text)))
+    entities = scan_entities(text, kinds=("catastral",))
+    return list(set(entity.value for entity in entities))
 
-# Valida una referencia individual.
+# Valida una referencia individual, incluidos sus caracteres de control.
 def is_valid_ref_cat(ref: str) -> bool:
-    ref = ref.strip().upper()
-    return bool(CATASTRAL_PATTERN.fullmatch(ref))
+    return is_valid_catastral_ref(ref.strip())
 
 # Compara referencias detectadas por el LLM frente a las detectadas por regex en el texto completo.
 def validate_references(llm_refs, full_text_refs):
-    llm_set = set(ref.upper() for ref in llm_refs)
-    full_set = set(ref.upper() for ref in full_text_refs)
+    llm_set = set(re.sub(r"\s", "", ref).upper() for ref in llm_refs)
+    full_set = set(re.sub(r"\s", "", ref).upper() for ref in full_text_refs)
 
     missing = full_set - llm_set
     extra = llm_set - full_set
 
     return {
         "missing_from_llm": list(missing),
-        "unexpected_from_llm": list(extra)
+        "unexpected_from_llm": list(extra),
+        "invalid_control": sorted(ref for ref in llm_set if not is_valid_ref_cat(ref))
     }
@@ -1,9 +1,28 @@
 import json
 import logging
-from typing import List, Dict, Any
-
-from llm_extractor import extract_deed_chunk
-from deed_processor import extract_catastral_refs_regex, validate_references
+import re
+from collections import deque
+from collections.abc import Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from disk_cache import DiskCache, make_key
+from llm_extractor import (
+    CHARS_PER_TOKEN,
+    CONTEXT_WINDOW,
+    DEED_OUTPUT_TOKENS,
+    PROMPT_VERSION,
+    chars_per_token,
+    deed_prompt_overhead,
+    estimate_tokens,
+    extract_deed_chunk,
+    last_response_cached,
+    modelo,
+    record_parse_result,
+)
+from deed_processor import CATASTRAL_PATTERN, extract_catastral_refs_regex, validate_references
+from inventory_dedup import merge_duplicate_items
+from llm_json import parse_llm_json
 
 
 # ==========================
@@ -23,7 +42,8 @@ def normalize_text(full_text) -> str:
     Asegura que el texto siempre sea string.
     Corrige el problema donde OCR devuelve lista de páginas.
     """
-    if isinstance(full_text, list):
+    if isinstance(full_text, (list, Sequence)) and not isinstance(full_text, str):
+        # Lista de páginas (o SpilledPages del modo de baja memoria del OCR)
         logger.info("Convirtiendo lista de páginas a string único.")
         return "\n".join(full_text)
 
@@ -32,32 +52,28 @@ def normalize_text(full_text) -> str:
 
     return full_text
 
-def safe_json_load(raw: str):
+def deed_result_from_json(data) -> Optional[Dict[str, Any]]:
     """
-    Extrae el primer bloque JSON válido de una respuesta LLM.
+    Normaliza el JSON recuperado de un chunk a {"tipo", "inventario", "alertas"}.
+    Si se recuperaron varios objetos, se juntan los inventarios de los que
+    traen "inventario" o, si no hay, los objetos que parecen bienes (tienen
+    "descripcion").
     """
-    import re
-
-    if not raw:
-        return None
-
-    # Elimina markdown ```json
-    raw = raw.strip()
-    raw = re.sub(r"^```json", "", raw)
-    raw = re.sub(r"^```", "", raw)
-    raw = re.sub(r"```$", "", raw)
+    if isinstance(data, dict):
+        return data or None
 
-    # Busca el primer objeto JSON {...}
-    match = re.search(r"\{.*\}", raw, re.DOTALL)
-    if not match:
+    if not isinstance(data, list):
         return None
 
-    json_str = match.group(0)
+    dicts = [item for item in data if isinstance(item, dict)]
+    with_inventory = [item for item in dicts if isinstance(item.get("inventario"), list)]
+    if with_inventory:
+        merged = dict(with_inventory[0])
+        merged["inventario"] = [prop for item in with_inventory for prop in item["inventario"]]
+        return merged
 
-    try:
-        return json.loads(json_str)
-    except:
-        return None
+    items = [item for item in dicts if "descripcion" in item]
+    return {"inventario": items} if items else None
 
 
 # ==========================
@@ -76,66 +92,579 @@ def chunk_text(text: str, max_chars: int = 4000) -> List[str]:
     logger.info(f"Texto dividido en {len(chunks)} chunks.")
     return chunks
 
+
+# ==========================
+# CHUNKING POR TOKENS
+# ==========================
+def deed_chunk_budget(
+    context_window: Optional[int] = None,
+    prompt_overhead: Optional[int] = None,
+    output_tokens: int = DEED_OUTPUT_TOKENS,
+    ratio: Optional[float] = None
+) -> int:
+    """
+    Tokens de texto que caben en cada chunk: ventana de contexto del
+    modelo menos el prompt de instrucciones y la respuesta reservada.
+    ratio: caracteres/token con los que estimar el prompt (ver
+    estimate_tokens).
+    """
+    context_window = context_window or CONTEXT_WINDOW
+    if prompt_overhead is None:
+        prompt_overhead = deed_prompt_overhead(ratio)
+
+    budget = context_window - prompt_overhead - output_tokens
+    if budget <= 0:
+        raise ValueError(
+            f"La ventana de contexto ({context_window} tokens) no deja sitio para el texto "
+            f"(prompt {prompt_overhead}, respuesta {output_tokens})."
+        )
+
+    return budget
+
+
+def _cut_index(text: str, max_tokens: int, ratio: float) -> int:
+    """
+    Posición hasta la que text cabe en max_tokens, preferentemente en un
+    salto de línea y si no en un espacio (nunca en mitad de una palabra
+    salvo que no haya otra opción).
+    """
+    limit = min(len(text), max(1, int(max_tokens * ratio)))
+
+    while True:
+        cut = text.rfind("\n", limit // 2, limit)
+        if cut <= 0:
+            cut = text.rfind(" ", limit // 2, limit)
+        if cut <= 0:
+            cut = limit
+
+        if limit <= 1 or estimate_tokens(text[:cut], ratio) <= max_tokens:
+            return cut
+
+        limit = int(limit * 0.9)
+
+
+# ==========================
+# CHUNKING POR ESTRUCTURA
+# ==========================
+# Encabezado numerado de un elemento del inventario ("3.- Finca ...")
+NUMBERED_HEADER = re.compile(r"^\s*\d+\s*\.\s*-")
+
+# Encabezado de sección de régimen; solo en líneas cortas, para no tomar
+# por encabezado una mención dentro de una descripción
+REGIMEN_HEADING = re.compile(r"NATURALEZA\s+(GANANCIAL|PRIVATIVA)")
+MAX_HEADING_CHARS = 80
+
+
+def is_regimen_heading(line: str) -> bool:
+    return len(line.strip()) <= MAX_HEADING_CHARS and bool(REGIMEN_HEADING.search(line))
+
+
+def iter_deed_blocks(pages: Iterable[str]) -> Iterator[str]:
+    """
+    Divide el texto en bloques que empiezan en un encabezado numerado o
+    en un encabezado de régimen; el texto previo al primero forma su
+    propio bloque.
+    """
+    block = []
+
+    for page in pages:
+        for line in page.split("\n"):
+            if block and (NUMBERED_HEADER.match(line) or is_regimen_heading(line)):
+                yield "\n".join(block)
+                block = []
+            block.append(line)
+
+    if block:
+        yield "\n".join(block)
+
+
+def iter_structured_chunks(
+    pages: Iterable[str],
+    max_tokens: int,
+    ratio: float = CHARS_PER_TOKEN
+) -> Iterator[str]:
+    """
+    Empaqueta bloques completos (ver iter_deed_blocks) en chunks de hasta
+    max_tokens, de modo que ningún elemento del inventario queda partido
+    entre dos chunks. Solo un bloque que por sí solo supera el presupuesto
+    se corta, en saltos de línea o espacios.
+
+    Cada chunk empieza con el encabezado de régimen vigente, marcado como
+    "(continuación)", para que el modelo sepa bajo qué sección están los
+    bienes aunque el encabezado original quedase en un chunk anterior.
+
+    ratio es la ratio caracteres/token fijada al empezar el documento:
+    aquí no se lee la calibrada, que cambia mientras llegan respuestas
+    del modelo y haría depender los cortes de su orden de llegada.
+    """
+    heading = None
+    parts: List[str] = []
+    size = 0
+
+    def start(with_context: bool):
+        if with_context and heading:
+            context = f"{heading} (continuación)"
+            return [context], estimate_tokens(context, ratio)
+        return [], 0
+
+    for block in iter_deed_blocks(pages):
+        first_line = block.split("\n", 1)[0]
+        opens_section = is_regimen_heading(first_line)
+        tokens = estimate_tokens(block, ratio)
+
+        if parts and size + tokens > max_tokens:
+            yield "\n".join(parts)
+            parts, size = start(with_context=not opens_section)
+
+        # Bloque que no cabe ni en un chunk vacío: se corta en trozos,
+        # cada uno con el encabezado de régimen como contexto
+        while size + tokens > max_tokens:
+            cut = _cut_index(block, max(1, max_tokens - size), ratio)
+            parts.append(block[:cut])
+            yield "\n".join(parts)
+            block = block[cut + 1:] if block[cut:cut + 1] in ("\n", " ") else block[cut:]
+            parts, size = start(with_context=True)
+            tokens = estimate_tokens(block, ratio)
+
+        if not parts:
+            parts, size = start(with_context=not opens_section)
+
+        parts.append(block)
+        size += tokens
+
+        if opens_section:
+            heading = first_line.strip()
+
+    if any(part.strip() for part in parts):
+        yield "\n".join(parts)
+
+
+def chunk_deed_text(text: str, max_tokens: int, ratio: float = CHARS_PER_TOKEN) -> List[str]:
+    chunks = list(iter_structured_chunks([text], max_tokens, ratio))
+    logger.info(f"Texto dividido en {len(chunks)} chunks de hasta {max_tokens} tokens.")
+    return chunks
+
+
+# ==========================
+# PREFILTRO DE CHUNKS
+# ==========================
+# Vocabulario de inventario que exige el prompt de extract_deed_chunk: un
+# chunk sin ninguna de estas palabras ni referencias catastrales no puede
+# aportar bienes y no se envía al modelo
+INVENTORY_KEYWORDS = re.compile(
+    r"\b(finca|vivienda|departamento|parcela|solar|local|garaje|trastero|campo)(?:e?s)?\b",
+    re.IGNORECASE
+)
+
+
+def is_inventory_candidate(chunk: str) -> bool:
+    return bool(INVENTORY_KEYWORDS.search(chunk) or CATASTRAL_PATTERN.search(chunk.upper()))
+
+
+# ==========================
+# CHECKPOINTS
+# ==========================
+class DeedCheckpoint:
+    """
+    Estado por chunk de una escritura, para reanudar un procesamiento
+    interrumpido o con chunks fallidos.
+
+    Cada entrada se identifica por el documento (hash del fichero o del
+    texto), el modelo, la versión de prompt y el propio chunk. Al
+    reprocesar, los chunks correctos se reutilizan y solo se vuelven a
+    enviar los fallidos, saltándose la caché del LLM (que devolvería la
+    misma respuesta inválida).
+
+    Junto al documento se guarda también cómo se troceó (load_plan /
+    save_plan), para que al reprocesarlo salgan los mismos chunks.
+    """
+
+    def __init__(self, store: DiskCache, document_id: str):
+        self.store = store
+        self.document_id = document_id
+
+    def _key(self, idx: int, chunk: str) -> str:
+        return make_key("deed-chunk", self.document_id, modelo, PROMPT_VERSION, idx, chunk)
+
+    def _plan_key(self, max_tokens: Optional[int]) -> str:
+        # Con la ventana de contexto o la respuesta reservada cambia el
+        # presupuesto por defecto, y el plan guardado deja de valer
+        return make_key(
+            "deed-plan", self.document_id, modelo, PROMPT_VERSION, max_tokens,
+            CONTEXT_WINDOW, DEED_OUTPUT_TOKENS
+        )
+
+    def load_plan(self, max_tokens: Optional[int]) -> Optional[Tuple[int, float]]:
+        """(presupuesto de tokens, ratio caracteres/token) de la primera ejecución."""
+        raw = self.store.get(self._plan_key(max_tokens))
+        if raw is None:
+            return None
+        plan = json.loads(raw)
+        return plan["max_tokens"], plan["ratio"]
+
+    def save_plan(self, max_tokens: Optional[int], budget: int, ratio: float) -> None:
+        self.store.set(
+            self._plan_key(max_tokens),
+            json.dumps({"max_tokens": budget, "ratio": ratio})
+        )
+
+    def load(self, idx: int, chunk: str) -> Optional[Dict[str, Any]]:
+        """{"ok": bool, "parsed": dict | None} o None si no se procesó."""
+        raw = self.store.get(self._key(idx, chunk))
+        return json.loads(raw) if raw is not None else None
+
+    def save(self, idx: int, chunk: str, parsed: Optional[Dict[str, Any]]) -> None:
+        self.store.set(
+            self._key(idx, chunk),
+            json.dumps({"ok": parsed is not None, "parsed": parsed}, ensure_ascii=False)
+        )
+
+
+def document_id_for_text(text: str) -> str:
+    return make_key("deed-text", text)
+
+
+def _chunking_plan(
+    max_tokens: Optional[int],
+    checkpoint: Optional[DeedCheckpoint]
+) -> Tuple[int, float]:
+    """
+    Presupuesto de tokens por chunk y ratio caracteres/token con los que
+    se trocea un documento, fijados al empezar (ver chars_per_token).
+
+    Con checkpoint se reutilizan los de la primera ejecución sobre ese
+    documento: la ratio calibrada cambia con cada respuesta del modelo y,
+    sin esto, reprocesar la misma escritura daría otros chunks, que no
+    encontrarían ni sus checkpoints ni sus respuestas en la caché del LLM.
+    """
+    if checkpoint is not None:
+        plan = checkpoint.load_plan(max_tokens)
+        if plan is not None:
+            return plan
+
+    ratio = chars_per_token()
+    budget = max_tokens or deed_chunk_budget(ratio=ratio)
+
+    if checkpoint is not None:
+        checkpoint.save_plan(max_tokens, budget, ratio)
+
+    return budget, ratio
+
+
 # ==========================
 # FUNCIÓN PRINCIPAL
 # ==========================
-def process_deed(full_text) -> Dict[str, Any]:
+def process_deed(
+    full_text,
+    max_tokens: Optional[int] = None,
+    max_in_flight: int = 1,
+    checkpoint_store: Optional[DiskCache] = None,
+    document_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    max_tokens: tokens de texto por chunk (por defecto deed_chunk_budget()).
+    max_in_flight: chunks enviados al modelo en paralelo.
+    checkpoint_store: caché donde guardar el estado de cada chunk para
+        reanudar (ver DeedCheckpoint).
+    document_id: identificador del documento para los checkpoints (por
+        defecto, hash del texto).
+    """
     logger.info("Inicio de procesamiento de escritura.")
 
     full_text = normalize_text(full_text)
 
-    chunks = chunk_text(full_text)
+    checkpoint = None
+    if checkpoint_store is not None:
+        checkpoint = DeedCheckpoint(
+            checkpoint_store, document_id or document_id_for_text(full_text)
+        )
 
-    all_properties = []
-    tipo = None
-    all_alerts = []
-    failed_chunks = 0
+    max_tokens, ratio = _chunking_plan(max_tokens, checkpoint)
+
+    chunks = chunk_deed_text(full_text, max_tokens, ratio)
+
+    return _process_chunks(chunks, lambda: full_text, max_in_flight, checkpoint)
+
+
+def process_deed_stream(
+    pages: Iterable[str],
+    max_tokens: Optional[int] = None,
+    max_in_flight: int = 1,
+    checkpoint_store: Optional[DiskCache] = None,
+    document_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Variante en streaming de process_deed.
 
-    for idx, chunk in enumerate(chunks):
-        logger.info(f"Procesando chunk {idx + 1}/{len(chunks)}")
+    Consume las páginas a medida que llegan (p. ej. desde
+    ocr.iter_text_by_pages) y envía cada chunk al LLM en cuanto se
+    completa, solapando el OCR de las páginas siguientes con la inferencia.
 
+    Con checkpoint_store hay que indicar document_id (p. ej. el hash del
+    fichero), ya que el texto completo no se conoce hasta el final.
+    """
+    logger.info("Inicio de procesamiento de escritura (streaming).")
+
+    checkpoint = None
+    if checkpoint_store is not None:
+        if not document_id:
+            raise ValueError("process_deed_stream necesita document_id para usar checkpoints.")
+        checkpoint = DeedCheckpoint(checkpoint_store, document_id)
+
+    # Fijado antes de empezar: los chunks se cortan mientras llegan
+    # respuestas del modelo, que recalibran chars_per_token
+    max_tokens, ratio = _chunking_plan(max_tokens, checkpoint)
+
+    seen_pages = []
+
+    def tracked_pages():
+        for page in pages:
+            seen_pages.append(page)
+            yield page
+
+    chunks = iter_structured_chunks(tracked_pages(), max_tokens, ratio)
+
+    return _process_chunks(chunks, lambda: "\n".join(seen_pages), max_in_flight, checkpoint)
+
+
+def _extract_chunk(idx: int, chunk: str, use_cache: bool = True):
+    """
+    Llamada al LLM y parseo de un chunk.
+
+    Una respuesta de la caché que no parsea se pide de nuevo una vez sin
+    caché, y la nueva la sustituye; si no, el chunk fallaría siempre.
+
+    Devuelve (JSON parseado o None si el chunk falla, alertas del fallo).
+    """
+    logger.info(f"Procesando chunk {idx + 1}")
+
+    for use_cache in ((True, False) if use_cache else (False,)):
         try:
-            raw = extract_deed_chunk(chunk)
+            raw = extract_deed_chunk(chunk, use_cache=use_cache)
         except Exception as e:
             logger.error(f"Error LLM en chunk {idx + 1}: {str(e)}")
-            all_alerts.append(f"Error LLM en chunk {idx + 1}")
-            failed_chunks += 1
-            continue
+            return None, [f"Error LLM en chunk {idx + 1}"]
+
+        from_cache = use_cache and last_response_cached()
 
         # Protección adicional
         if not raw or not isinstance(raw, str):
             logger.warning(f"Respuesta vacía o inválida en chunk {idx + 1}")
-            failed_chunks += 1
+            if from_cache:
+                continue
+            return None, []
+
+        result = parse_llm_json(raw)
+        parsed = deed_result_from_json(result.data)
+
+        if parsed is not None:
+            break
+
+        logger.warning(f"JSON inválido en chunk {idx + 1}")
+        record_parse_result(False)
+        if not from_cache:
+            return None, [f"JSON inválido en chunk {idx + 1}"]
+
+        logger.warning(f"Respuesta en caché no válida en chunk {idx + 1}: se pide de nuevo al modelo")
+
+    record_parse_result(True, repaired=result.repaired)
+
+    # Respuesta recuperada parcialmente: se conserva, pero queda constancia
+    if result.repaired:
+        repairs = ", ".join(result.repairs)
+        logger.warning(f"JSON reparado en chunk {idx + 1} ({repairs})")
+        return parsed, [f"JSON reparado en chunk {idx + 1} ({repairs})"]
+
+    return parsed, []
+
+
+# ==========================
+# RÉGIMEN POR ENCABEZADOS
+# ==========================
+def _heading_regimen(line: str) -> str:
+    return "ganancial" if REGIMEN_HEADING.search(line).group(1) == "GANANCIAL" else "privativo"
+
+
+def _regimen_changes(chunk: str) -> List[tuple]:
+    """(posición, régimen) de cada encabezado de régimen del chunk."""
+    changes = []
+    offset = 0
+
+    for line in chunk.split("\n"):
+        if is_regimen_heading(line):
+            changes.append((offset, _heading_regimen(line)))
+        offset += len(line) + 1
+
+    return changes
+
+
+def _item_offset(chunk: str, item: Dict[str, Any], position: int, start: int = 0) -> Optional[int]:
+    """
+    Posición del bien dentro del chunk: donde aparece el inicio de su
+    descripción o, si el modelo no la copió literalmente, el encabezado
+    numerado con el mismo orden que el bien.
+
+    Se busca a partir de start, justo tras el bien anterior: los bienes
+    vienen en el orden del texto y las descripciones son formularias
+    ("URBANA.- Vivienda unifamiliar sita en ..."), así que la primera
+    coincidencia del chunk puede ser la de otro bien.
+    """
+    description = item.get("descripcion")
+    if isinstance(description, str) and description.strip():
+        words = description.split()[:6]
+        match = re.compile(r"\s+".join(map(re.escape, words))).search(chunk, start)
+        if match:
+            return match.start()
+
+    headers = [m.start() for m in re.finditer(r"(?m)^\s*\d+\s*\.\s*-", chunk)]
+    if position < len(headers) and headers[position] >= start:
+        return headers[position]
+
+    return None
+
+
+def apply_heading_regimen(chunk: str, items: List[Dict[str, Any]], regimen: Optional[str]) -> Optional[str]:
+    """
+    Asigna a cada bien el régimen del último encabezado NATURALEZA
+    GANANCIAL/PRIVATIVA que lo precede en el texto, empezando por el
+    régimen vigente al inicio del chunk (regimen). Los bienes sin
+    encabezado previo conservan el régimen devuelto por el modelo.
+
+    Devuelve el régimen vigente al final del chunk, que se arrastra al
+    siguiente. Al depender solo del texto, el resultado no cambia con el
+    orden en que responda el modelo.
+    """
+    changes = _regimen_changes(chunk)
+    search_from = 0
+
+    for position, item in enumerate(items):
+        if not isinstance(item, dict):
             continue
 
-        try:
-            parsed = safe_json_load(raw)
-            if not parsed:
-                logger.warning(f"JSON inválido en chunk {idx + 1}")
-                all_alerts.append(f"JSON inválido en chunk {idx + 1}")
-                failed_chunks += 1
-                continue
-        except Exception:
-            logger.warning(f"JSON inválido en chunk {idx + 1}")
-            all_alerts.append(f"JSON inválido en chunk {idx + 1}")
+        current = regimen
+        if changes and [offset for offset, _ in changes] == [0]:
+            # Todo el chunk bajo un mismo encabezado
+            current = changes[0][1]
+        elif changes:
+            offset = _item_offset(chunk, item, position, search_from)
+            if offset is None:
+                continue  # posición desconocida: se conserva la del modelo
+            search_from = offset + 1
+            for change_offset, change_regimen in changes:
+                if change_offset <= offset:
+                    current = change_regimen
+
+        if current is not None:
+            item["regimen"] = current
+
+    return changes[-1][1] if changes else regimen
+
+
+def _process_chunks(
+    chunks: Iterable[str],
+    get_full_text: Callable[[], str],
+    max_in_flight: int = 1,
+    checkpoint: Optional[DeedCheckpoint] = None
+) -> Dict[str, Any]:
+    """
+    Extrae el inventario chunk a chunk y consolida el resultado.
+    get_full_text se evalúa al final, cuando ya se han consumido todos los chunks.
+
+    Los chunks sin vocabulario de inventario ni referencias catastrales
+    no se envían al LLM; sus números (desde 1) quedan en chunks_omitidos.
+
+    max_in_flight > 1 envía hasta ese número de chunks al modelo en
+    paralelo. Los resultados se consolidan siempre en el orden de los
+    chunks y el régimen se resuelve después con apply_heading_regimen,
+    así que id_fila, alertas y contadores coinciden con el modo secuencial.
+
+    Con checkpoint, los chunks ya extraídos en una ejecución anterior se
+    reutilizan (chunks_reanudados) y solo se reenvían los que fallaron.
+    """
+    all_properties = []
+    tipo = None
+    all_alerts = []
+    failed_chunks = 0
+    processed_chunks = 0
+    skipped_chunks = []
+    resumed_chunks = 0
+    regimen = None
+
+    # (índice, chunk, future de la extracción o None si se omite[, reanudado])
+    pending = deque()
+
+    def consume(idx, chunk, future, resumed=False):
+        nonlocal tipo, failed_chunks, regimen
+
+        if future is None:
+            # Chunk omitido: solo aporta los encabezados de régimen
+            regimen = apply_heading_regimen(chunk, [], regimen)
+            return
+
+        parsed, alerts = future.result()
+        all_alerts.extend(alerts)
+
+        if checkpoint is not None and not resumed:
+            checkpoint.save(idx, chunk, parsed)
+
+        if parsed is None:
             failed_chunks += 1
-            continue
+            regimen = apply_heading_regimen(chunk, [], regimen)
+            return
 
         if not tipo:
             tipo = parsed.get("tipo")
 
         # Inventario
         items = parsed.get("inventario", [])
-        if isinstance(items, list):
-            all_properties.extend(items)
+        if not isinstance(items, list):
+            items = []
+        regimen = apply_heading_regimen(chunk, items, regimen)
+        all_properties.extend(items)
 
         # Alertas
         alerts = parsed.get("alertas", [])
         if isinstance(alerts, list):
             all_alerts.extend(alerts)
 
+    def in_flight() -> int:
+        return sum(1 for entry in pending if entry[2] is not None)
+
+    def submit(idx, chunk):
+        """Future con (parsed, alertas) y si viene del checkpoint."""
+        previous = checkpoint.load(idx, chunk) if checkpoint is not None else None
+
+        if previous is not None and previous["ok"]:
+            logger.info(f"Chunk {idx + 1} reanudado desde checkpoint")
+            future = Future()
+            future.set_result((previous["parsed"], []))
+            return future, True
+
+        # Un chunk que ya falló se reintenta sin la caché del LLM
+        return executor.submit(_extract_chunk, idx, chunk, previous is None), False
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        for idx, chunk in enumerate(chunks):
+            if not is_inventory_candidate(chunk):
+                logger.info(f"Chunk {idx + 1} sin vocabulario de inventario: no se envía al LLM")
+                skipped_chunks.append(idx + 1)
+                pending.append((idx, chunk, None))
+            else:
+                processed_chunks += 1
+                future, resumed = submit(idx, chunk)
+                resumed_chunks += resumed
+                pending.append((idx, chunk, future, resumed))
+
+            while pending and (pending[0][2] is None or in_flight() >= max_in_flight):
+                consume(*pending.popleft())
+
+        while pending:
+            consume(*pending.popleft())
+
     logger.info("Consolidando resultados...")
 
+    full_text = get_full_text()
+
     # ==========================
     # DEDUPLICACIÓN
     # ==========================
@@ -144,6 +673,12 @@ def process_deed(full_text) -> Dict[str, Any]:
         if isinstance(refs, list):
             prop["referencias_catastrales"] = list(set(refs))
 
+    # Mismo bien extraído varias veces (inventario y adjudicación, o
+    # desde dos chunks): misma referencia catastral o descripción casi igual
+    all_properties, merges = merge_duplicate_items(all_properties)
+    if merges:
+        logger.info(f"Bienes duplicados fusionados: {sum(len(m) for _, m in merges)}")
+
     # ==========================
     # VALIDACIÓN GLOBAL REGEX
     # ==========================
@@ -168,18 +703,30 @@ def process_deed(full_text) -> Dict[str, Any]:
 
     logger.info("Proceso finalizado.")
 
-    if failed_chunks == len(chunks):
+    if processed_chunks and failed_chunks == processed_chunks:
         logger.error("Todos los chunks fallaron. Resultado inválido.")
 
     # GENERAR INDICE SECUENCIAL
     for idx, prop in enumerate(all_properties, start=1):
         prop["id_fila"] = idx
 
+    fusiones = [
+        {
+            "id_fila": all_properties[position]["id_fila"],
+            "descripciones_fusionadas": [item.get("descripcion") for item, _ in absorbed],
+            "motivos": sorted({reason for _, reason in absorbed})
+        }
+        for position, absorbed in merges
+    ]
+
     return {
         "tipo": tipo,
         "inventario": all_properties,
         "alertas_llm": all_alerts,
         "validacion_regex": validation,
-        "chunks_procesados": len(chunks),
-        "chunks_fallidos": failed_chunks
+        "chunks_procesados": processed_chunks,
+        "chunks_fallidos": failed_chunks,
+        "chunks_omitidos": skipped_chunks,
+        "chunks_reanudados": resumed_chunks,
+        "fusiones": fusiones
     }
@@ -0,0 +1,193 @@
+"""
+disk_cache.py
+
+Caché persistente clave/valor sobre SQLite, compartida por los módulos
+que necesitan reutilizar resultados costosos entre ejecuciones.
+
+- Tamaño máximo configurable con expulsión LRU.
+- Contadores de aciertos/fallos para medir el ahorro.
+- Segura entre hilos (una conexión protegida por lock).
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024  # 512 MB
+
+
+def default_cache_dir() -> str:
+    """
+    Directorio de caché por defecto (configurable con LLMTHON_CACHE_DIR).
+    """
+    return os.environ.get(
+        "LLMTHON_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "llmthonlegal")
+    )
+
+
+def make_key(*parts: Any) -> str:
+    """
+    Genera una clave SHA-256 estable a partir de cualquier valor serializable.
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def file_sha256(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """
+    Hash SHA-256 del contenido de un fichero, leído por bloques.
+    """
+    digest = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+class DiskCache:
+    """
+    Caché clave/valor (str -> str) en SQLite con límite de tamaño y LRU.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)"
+        )
+        self._conn.commit()
+
+        # Tamaño total mantenido en memoria: sumar la tabla en cada set()
+        # haría cada inserción más lenta a medida que crece la caché
+        self._total_bytes = self._stored_bytes()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?",
+                (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def set(self, key: str, value: str) -> None:
+        size = len(value.encode("utf-8"))
+
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time())
+            )
+            self._total_bytes += size - (previous[0] if previous else 0)
+            self._evict()
+            self._conn.commit()
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            previous = self._conn.execute(
+                "SELECT size FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.commit()
+            if previous:
+                self._total_bytes -= previous[0]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": entries,
+            "size_bytes": size,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _evict(self) -> None:
+        """
+        Elimina las entradas menos usadas hasta volver bajo max_bytes.
+        Debe llamarse con el lock adquirido.
+        """
+        if self._total_bytes <= self.max_bytes:
+            return
+
+        # Solo al superar el límite se recalcula el total real, por si otro
+        # proceso comparte el fichero
+        total = self._stored_bytes()
+        self._total_bytes = total
+        if total <= self.max_bytes:
+            return
+
+        to_free = total - self.max_bytes
+        expired = []
+
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_access ASC"
+        ):
+            expired.append((key,))
+            to_free -= size
+            self._total_bytes -= size
+            if to_free <= 0:
+                break
+
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", expired)
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
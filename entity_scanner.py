@@ -0,0 +1,259 @@
+"""
+entity_scanner.py
+
+Detección de entidades en el texto completo de un documento, sin LLM.
+
+Una sola expresión regular con una alternativa por tipo recorre el texto
+una vez y devuelve, con su posición (inicio, fin) en el texto original:
+- Referencias catastrales de 20 caracteres (parcela + cargo + 2 caracteres
+  de control, que se verifican) y de parcela (14 caracteres).
+- NIF (DNI, NIE) y CIF, con su dígito o letra de control verificado.
+- Fechas numéricas (dd/mm/aaaa) y con el mes en letra (15 de marzo de 2023).
+- Importes en formato español (1.234,56 €, 150.000 euros).
+
+Sirve para contrastar lo que devuelve el modelo (como validate_references)
+y para rellenar campos sin llamarlo (prefill_fields).
+"""
+
+import re
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional
+
+
+# ==========================
+# PATRONES
+# ==========================
+
+# Urbana: 7 dígitos (finca) + 7 alfanuméricos (hoja); rústica: 5 dígitos
+# (provincia y municipio) + sector + polígono + parcela. Se admite un espacio
+# entre grupos, habitual en escrituras: "2270710 YJ2727S 0001 WR".
+_PARCEL = r"\d{7}\s?[A-Z]{2}\d{4}[A-Z]|\d{5}[A-Z]\d{3}\s?\d{5}"
+
+# Referencia completa: parcela + cargo (4 dígitos) + 2 caracteres de control
+CATASTRAL_REF = rf"(?:{_PARCEL})\s?\d{{4}}\s?[A-Z]{{2}}"
+
+MONTHS = {
+    "enero": 1, "febrero": 2, "marzo": 3, "abril": 4, "mayo": 5, "junio": 6,
+    "julio": 7, "agosto": 8, "septiembre": 9, "setiembre": 9, "octubre": 10,
+    "noviembre": 11, "diciembre": 12,
+}
+
+_AMOUNT_NUMBER = r"\d{1,3}(?:\.\d{3})+(?:,\d{2})?|\d+(?:,\d{2})?"
+
+ENTITY_PATTERN = re.compile(
+    rf"(?<![\w.,])(?:"
+    rf"(?P<catastral>{CATASTRAL_REF})"
+    rf"|(?P<parcela>{_PARCEL})"
+    r"|(?P<nif>[XYZ]-?\d{7}-?[A-Z]|\d{8}-?[A-Z]|[ABCDEFGHJNPQRSUVW]-?\d{7}-?[0-9A-J])"
+    r"|(?P<fecha>\d{1,2}[/.-]\d{1,2}[/.-]\d{4}"
+    rf"|\d{{1,2}}\s+de\s+(?:{'|'.join(MONTHS)})\s+(?:de\s+|del\s+)?\d{{4}})"
+    rf"|(?P<importe>(?:{_AMOUNT_NUMBER})\s?(?:€|eur\b|euros\b)|\d{{1,3}}(?:\.\d{{3}})*,\d{{2}})"
+    r")(?!\w|[.,]\d)",
+    re.IGNORECASE
+)
+
+ENTITY_KINDS = ("catastral", "parcela", "nif", "fecha", "importe")
+
+
+@dataclass
+class Entity:
+    kind: str               # uno de ENTITY_KINDS
+    value: Any              # valor normalizado (ref/NIF sin espacios, fecha ISO, float)
+    start: int              # posición en el texto original
+    end: int
+    text: str               # texto tal cual aparece
+    valid: bool = True      # control verificado (catastral y nif)
+
+
+# ==========================
+# CARACTERES DE CONTROL
+# ==========================
+
+_CATASTRAL_WEIGHTS = (13, 15, 12, 5, 4, 17, 9, 21, 3, 7, 1)
+_CATASTRAL_LETTERS = "MQWERTYUIOPASDFGHJKLBZX"
+
+
+def _catastral_char_value(char: str) -> int:
+    if char.isdigit():
+        return int(char)
+    if char == "Ñ":
+        return 15
+    if char <= "N":
+        return ord(char) - 64
+    return ord(char) - 63
+
+
+def catastral_control(ref: str) -> str:
+    """
+    Los dos caracteres de control de una referencia de 20 caracteres,
+    calculados sobre cada mitad de la parcela más el cargo.
+    """
+    ref = ref.upper()
+    control = ""
+
+    for part in (ref[0:7], ref[7:14]):
+        total = sum(
+            _catastral_char_value(char) * weight
+            for char, weight in zip(part + ref[14:18], _CATASTRAL_WEIGHTS)
+        )
+        control += _CATASTRAL_LETTERS[total % 23]
+
+    return control
+
+
+def is_valid_catastral_ref(ref: str) -> bool:
+    ref = re.sub(r"\s", "", ref).upper()
+    match = ENTITY_PATTERN.fullmatch(ref)
+    return bool(match and match.group("catastral")) and catastral_control(ref) == ref[18:]
+
+
+_DNI_LETTERS = "TRWAGMYFPDXBNJZSQVHLCKE"
+_CIF_LETTERS = "JABCDEFGHI"
+
+
+def is_valid_nif(value: str) -> bool:
+    """
+    DNI, NIE o CIF con su dígito o letra de control correcto.
+    """
+    value = re.sub(r"[\s-]", "", value).upper()
+
+    if re.fullmatch(r"\d{8}[A-Z]", value):
+        return _DNI_LETTERS[int(value[:8]) % 23] == value[8]
+
+    if re.fullmatch(r"[XYZ]\d{7}[A-Z]", value):
+        number = int(str("XYZ".index(value[0])) + value[1:8])
+        return _DNI_LETTERS[number % 23] == value[8]
+
+    if re.fullmatch(r"[ABCDEFGHJNPQRSUVW]\d{7}[0-9A-J]", value):
+        digits = [int(d) for d in value[1:8]]
+        total = sum(digits[1::2])
+        for d in digits[0::2]:
+            total += sum(divmod(d * 2, 10))
+        control = (10 - total % 10) % 10
+
+        # Entidades que llevan letra, sociedades que llevan dígito, resto cualquiera
+        if value[0] in "NPQRSW":
+            return value[8] == _CIF_LETTERS[control]
+        if value[0] in "ABEH":
+            return value[8] == str(control)
+        return value[8] in (str(control), _CIF_LETTERS[control])
+
+    return False
+
+
+# ==========================
+# ESCANEO
+# ==========================
+
+def _parse_date(text: str) -> Optional[str]:
+    numeric = re.fullmatch(r"(\d{1,2})[/.-](\d{1,2})[/.-](\d{4})", text)
+    if numeric:
+        day, month, year = (int(g) for g in numeric.groups())
+    else:
+        day_text, month_text, year_text = re.fullmatch(
+            r"(\d{1,2})\s+de\s+(\w+)\s+(?:del?\s+)?(\d{4})", text, re.IGNORECASE
+        ).groups()
+        day, month, year = int(day_text), MONTHS[month_text.lower()], int(year_text)
+
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return None
+
+
+def _parse_amount(text: str) -> float:
+    number = re.match(r"[\d.,]+", text).group()
+    return float(number.replace(".", "").replace(",", "."))
+
+
+def scan_entities(text: str, kinds: Iterable[str] = ENTITY_KINDS) -> List[Entity]:
+    """
+    Recorre el texto una vez y devuelve las entidades en orden de aparición.
+
+    Las referencias y NIF con control incorrecto se devuelven con
+    valid=False (pueden ser errores de OCR); las fechas imposibles
+    (31/02/2023) se descartan.
+    """
+    kinds = set(kinds)
+    entities = []
+
+    for match in ENTITY_PATTERN.finditer(text):
+        kind = match.lastgroup
+        if kind not in kinds:
+            continue
+
+        raw = match.group()
+        valid = True
+
+        if kind in ("catastral", "parcela"):
+            value = re.sub(r"\s", "", raw).upper()
+            if kind == "catastral":
+                valid = catastral_control(value) == value[18:]
+        elif kind == "nif":
+            value = raw.replace("-", "").upper()
+            valid = is_valid_nif(value)
+        elif kind == "fecha":
+            value = _parse_date(raw)
+            if value is None:
+                continue
+        else:
+            value = _parse_amount(raw)
+
+        entities.append(Entity(kind, value, match.start(), match.end(), raw, valid))
+
+    return entities
+
+
+def entity_values(entities: Iterable[Entity], kind: str, valid_only: bool = True) -> List[Any]:
+    """
+    Valores distintos de un tipo, en orden de primera aparición.
+    """
+    values = []
+    for entity in entities:
+        if entity.kind == kind and (entity.valid or not valid_only) and entity.value not in values:
+            values.append(entity.value)
+    return values
+
+
+# Etiqueta "CIF:" / "C.I.F." inmediatamente antes del valor
+_CIF_LABEL = re.compile(r"C\.?\s?I\.?\s?F\.?\s*:?\s*-?$", re.IGNORECASE)
+
+# Primera letra de un CIF de persona jurídica o entidad
+_COMPANY_CIF_LETTERS = "ABCDEFGHJNPQRSUVW"
+
+
+def _is_supplier_cif(entity: Entity, text: str) -> bool:
+    """
+    CIF de empresa por su forma, o cualquier NIF precedido de la etiqueta
+    "CIF". Un DNI/NIE sin etiqueta suele ser del cliente (p. ej. el titular
+    de una tarjeta de combustible) y no se toma como CIF del proveedor.
+    """
+    if entity.value[0] in _COMPANY_CIF_LETTERS:
+        return True
+
+    line_start = text.rfind("\n", 0, entity.start) + 1
+    return bool(_CIF_LABEL.search(text[line_start:entity.start]))
+
+
+def prefill_fields(text: str) -> Dict[str, Any]:
+    """
+    Campos de factura que el texto determina sin ambigüedad: solo se
+    incluye "cif" o "fecha" si aparece exactamente un valor válido.
+    Para "cif" solo cuentan los CIF de empresa (ver _is_supplier_cif).
+    """
+    entities = scan_entities(text, kinds=("nif", "fecha"))
+    fields = {}
+
+    cifs = entity_values(
+        (entity for entity in entities if entity.kind == "nif" and _is_supplier_cif(entity, text)),
+        "nif"
+    )
+    if len(cifs) == 1:
+        fields["cif"] = cifs[0]
+
+    dates = entity_values(entities, "fecha")
+    if len(dates) == 1:
+        fields["fecha"] = dates[0]
+
+    return fields
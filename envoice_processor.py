@@ -3,6 +3,8 @@ processor.py
 
 Módulo de procesamiento para:
 - Ejecutar la extracción de facturas usando extract_invoice (NO modificar).
+- Leer sin LLM las tablas de formato conocido (tarjeta de combustible).
+- Completar CIF y fecha desde el texto cuando el modelo los omite.
 - Limpiar la respuesta del modelo.
 - Convertir a JSON seguro.
 - Validar estructura obligatoria.
@@ -12,11 +14,22 @@ Módulo de procesamiento para:
 Preparado para ser importado desde app.py.
 """
 
-import json
 import re
-from typing import Dict, Any
-
-from llm_extractor import extract_invoice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+
+from entity_scanner import prefill_fields
+from llm_json import ParsedJSON, parse_llm_json
+from llm_extractor import (
+    estimate_tokens,
+    extract_invoice,
+    extract_invoice_batch,
+    extract_invoice_lines,
+    last_response_cached,
+    record_parse_result,
+)
+from page_dedup import PageDeduplicator, page_text_and_hash
 
 
 # Campos obligatorios definidos por contrato con el modelo
@@ -52,48 +65,23 @@ class InvalidAmountError(InvoiceProcessingError):
     pass
 
 
-def extract_json_block(text: str) -> str:
+def _parse_lines(response_text: str) -> Tuple[List[Any], ParsedJSON]:
     """
-    Extrae bloque JSON ya sea array [...] o objeto {...}
+    Líneas de la respuesta del modelo y resultado del parseo tolerante
+    (llm_json), que indica las reparaciones aplicadas.
     """
-    if not text:
+    if not response_text or not response_text.strip():
         raise InvalidJSONError("Respuesta vacía del modelo.")
 
-    text = text.strip()
-
-    # Si empieza por array, devolver desde primer [ hasta último ]
-    if text.startswith("["):
-        start = text.find("[")
-        end = text.rfind("]")
-    else:
-        start = text.find("{")
-        end = text.rfind("}")
-
-    if start == -1 or end == -1 or end <= start:
+    parsed = parse_llm_json(response_text)
+    if not parsed.ok:
         raise InvalidJSONError("No se encontró un bloque JSON válido.")
 
-    return text[start:end + 1]
-
-
-def parse_model_response(response_text: str):
-
-    if not response_text:
-        raise InvalidJSONError("Respuesta vacía del modelo.")
-
-    cleaned = response_text.strip()
-
-    # Eliminar bloques markdown ```json ... ```
-    if cleaned.startswith("```"):
-        cleaned = re.sub(r"^```[a-zA-Z]*", "", cleaned)
-        cleaned = cleaned.rstrip("`").strip()
+    data = parsed.data
 
-    # Extraer bloque JSON (array u objeto)
-    json_block = extract_json_block(cleaned)
-
-    try:
-        data = json.loads(json_block)
-    except json.JSONDecodeError as e:
-        raise InvalidJSONError(f"JSON inválido: {str(e)}")
+    # Salida con esquema: las líneas vienen en {"lineas": [...]}
+    if isinstance(data, dict) and isinstance(data.get("lineas"), list):
+        data = data["lineas"]
 
     # Si devuelve objeto único, convertir en lista
     if isinstance(data, dict):
@@ -102,9 +90,12 @@ def parse_model_response(response_text: str):
     if not isinstance(data, list):
         raise InvalidJSONError("La respuesta no es un array JSON válido.")
 
-    return data
+    return data, parsed
 
 
+def parse_model_response(response_text: str):
+    return _parse_lines(response_text)[0]
+
 
 def validate_required_fields(data: Dict[str, Any]) -> None:
     """
@@ -155,11 +146,211 @@ def normalize_data_types(data: Dict[str, Any]) -> Dict[str, Any]:
     return data
 
 
-def process_invoice_text(text: str) -> Dict[str, Any]:
-    raw_response = extract_invoice(text)
+# ==========================
+# TABLA DE TARJETA DE COMBUSTIBLE (SIN LLM)
+# ==========================
+
+FUEL_TABLE_HEADER = re.compile(
+    r"Ref\.?\s+Fecha\s*/\s*Hora\s+Producto\s+Establecimiento.*Cantidad\s+P\.\s?Un\.\s+Dto\.\s+Importe",
+    re.IGNORECASE
+)
+
+_AMOUNT = r"-?\d{1,3}(?:\.\d{3})*,\d+"
+
+# 5446 20-08-2014 11:33 Gasol 5 Amado Gestion, S.L 52,84 1,444€ 1,59€ 74,71€
+FUEL_ROW = re.compile(
+    r"^(?P<ref>\d+)\s+(?P<fecha>\d{2}[-/]\d{2}[-/]\d{4})\s+\d{1,2}:\d{2}\s+"
+    rf"(?P<descripcion>.+?)\s+(?P<cantidad>{_AMOUNT})\s+"
+    rf"{_AMOUNT}\s*€?\s+{_AMOUNT}\s*€?\s+{_AMOUNT}\s*€?$"
+)
+
+# Cualquier línea que empiece como una fila (ref + fecha + hora)
+FUEL_ROW_START = re.compile(r"^\d+\s+\d{2}[-/]\d{2}[-/]\d{4}\s+\d{1,2}:\d{2}\b")
 
-    parsed_list = parse_model_response(raw_response)
+FUEL_TOTALS = re.compile(rf"^Totales:\s*(?P<cantidad>{_AMOUNT})\b")
 
+# Gasol 5 [ 95 ] 52,84 1,59 74,71€  (sección "Resumen de Carburantes")
+FUEL_PRODUCT = re.compile(r"^(?P<producto>.+?)\s*\[\s*\d+\s*\]")
+
+FUEL_CIF = re.compile(r"^CIF:\s*(?P<cif>[A-Z0-9]{9})\b")
+FUEL_INVOICE_NUMBER = re.compile(r"N[úu]m\.?\s*Factura\s+(?P<numero>\d+)", re.IGNORECASE)
+POSTAL_CODE_LINE = re.compile(r"^\d{5}\s+\S")
+
+
+def _parse_amount(value: str) -> float:
+    """'1.234,56' -> 1234.56 conservando el signo."""
+    return float(value.replace(".", "").replace(",", "."))
+
+
+# Columnas de la tabla de consumos para el modo layout de ocr
+# (OCRSettings(table_columns=FUEL_TABLE_COLUMNS))
+FUEL_TABLE_COLUMNS = (
+    "Ref.", "Fecha / Hora", "Producto", "Establecimiento", "Matrícula",
+    "Km", "Cantidad", "P.Un.", "Dto.", "Importe",
+)
+
+
+def _fuel_card_header(lines: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Datos comunes a todas las líneas, tomados de la cabecera del emisor
+    (nombre, dirección, "CP localidad", provincia, CIF) y del número de
+    factura. None si falta alguno.
+    """
+    cif_index = next(
+        (i for i, line in enumerate(lines) if FUEL_CIF.match(line)),
+        None
+    )
+    if cif_index is None or cif_index < 3 or not POSTAL_CODE_LINE.match(lines[cif_index - 2]):
+        return None
+
+    invoice_number = FUEL_INVOICE_NUMBER.search("\n".join(lines))
+    if not invoice_number:
+        return None
+
+    return {
+        "numero_orden": None,
+        "numero_factura": invoice_number.group("numero"),
+        "cif": FUEL_CIF.match(lines[cif_index]).group("cif"),
+        "proveedor": lines[0],
+        "comunidad_autonoma": lines[cif_index - 1],
+    }
+
+
+def _iso_date(value: str) -> str:
+    day, month, year = re.split(r"[-/]", value)
+    return f"{year}-{month}-{day}"
+
+
+def _totals_match(items: List[Dict[str, Any]], total: Optional[float]) -> bool:
+    return total is not None and abs(sum(item["cantidad"] for item in items) - total) <= 0.005
+
+
+def parse_fuel_card_invoice(text: str) -> Optional[List[Dict[str, Any]]]:
+    """
+    Extrae las líneas de consumo de una factura de tarjeta de combustible
+    con la tabla "Ref. Fecha / Hora Producto Establecimiento Matrícula Km
+    Cantidad P.Un. Dto. Importe" sin pasar por el LLM.
+
+    Devuelve None si la página no tiene ese formato o si el resultado no
+    es completo y coherente (cabecera sin CIF/proveedor/número, filas que
+    no encajan, productos desconocidos o cantidades que no cuadran con
+    "Totales:"); en ese caso se usa el LLM.
+    """
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+
+    header_index = next(
+        (i for i, line in enumerate(lines) if FUEL_TABLE_HEADER.search(line)),
+        None
+    )
+    if header_index is None:
+        return None
+
+    header = _fuel_card_header(lines[:header_index])
+    if header is None:
+        return None
+
+    # Filas de la tabla hasta "Totales:"
+    rows = []
+    total = None
+    for line in lines[header_index + 1:]:
+        totals = FUEL_TOTALS.match(line)
+        if totals:
+            total = _parse_amount(totals.group("cantidad"))
+            break
+
+        match = FUEL_ROW.match(line)
+        if not match:
+            if FUEL_ROW_START.match(line):
+                return None  # fila con formato inesperado
+            continue
+        rows.append(match)
+
+    if not rows or total is None:
+        return None
+
+    # Los nombres de producto salen del resumen de carburantes de la propia
+    # página; así se separa el producto del establecimiento
+    products = sorted(
+        {m.group("producto").strip() for m in map(FUEL_PRODUCT.match, lines) if m},
+        key=len,
+        reverse=True
+    )
+
+    items = []
+    for match in rows:
+        descripcion = match.group("descripcion")
+        articulo = next((p for p in products if descripcion.startswith(p + " ")), None)
+        if articulo is None:
+            return None
+
+        items.append({
+            **header,
+            "fecha": _iso_date(match.group("fecha")),
+            "articulo": articulo,
+            "cantidad": _parse_amount(match.group("cantidad")),
+        })
+
+    if not _totals_match(items, total):
+        return None
+
+    return items
+
+
+FUEL_ROW_DATE = re.compile(r"^(?P<fecha>\d{2}[-/]\d{2}[-/]\d{4})\b")
+FUEL_CELL_AMOUNT = re.compile(rf"^{_AMOUNT}$")
+
+
+def items_from_table_rows(
+    text: str,
+    rows: List[Dict[str, str]]
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Construye las líneas de factura a partir de las filas de la tabla de
+    consumos reconstruida por coordenadas (PageResult.table_rows con
+    FUEL_TABLE_COLUMNS). La columna de cada valor viene de la geometría
+    de la página, así que "cantidad" no se confunde con P.Un. o Dto.
+
+    Los datos de cabecera y "Totales:" se leen del texto de la página.
+    None si falta algún dato o las cantidades no cuadran con el total.
+    """
+    if not rows:
+        return None
+
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    header = _fuel_card_header(lines)
+    if header is None:
+        return None
+
+    items = []
+    for row in rows:
+        date = FUEL_ROW_DATE.match(row.get("Fecha / Hora", ""))
+        cantidad = row.get("Cantidad", "")
+        articulo = row.get("Producto", "").strip()
+
+        if not date or not articulo or not FUEL_CELL_AMOUNT.match(cantidad):
+            return None
+
+        items.append({
+            **header,
+            "fecha": _iso_date(date.group("fecha")),
+            "articulo": articulo,
+            "cantidad": _parse_amount(cantidad),
+        })
+
+    total = next(
+        (_parse_amount(m.group("cantidad")) for m in map(FUEL_TOTALS.match, lines) if m),
+        None
+    )
+    if not _totals_match(items, total):
+        return None
+
+    return items
+
+
+def validate_items(parsed_list):
+    """
+    Normaliza y valida cada línea devuelta por el modelo.
+    """
     validated_items = []
 
     for item in parsed_list:
@@ -170,28 +361,407 @@ def process_invoice_text(text: str) -> Dict[str, Any]:
 
     return validated_items
 
-from typing import List
 
+# ==========================
+# REINTENTO POR LÍNEAS
+# ==========================
 
-def process_multiple_invoices(pages_text: List[str]) -> List[Dict[str, Any]]:
-    invoices = []
-    global_counter = 1  # numeración real por línea
+# Peticiones de corrección por página para las líneas que no validan;
+# agotadas, se descartan esas líneas y se conservan las válidas
+ROW_RETRY_BUDGET = 2
+
+# Fragmento de página que acompaña a las líneas a corregir: la cabecera
+# (emisor, CIF, número de factura) y el entorno de cada línea
+ROW_CONTEXT_HEADER_LINES = 15
+ROW_CONTEXT_MARGIN = 2
+
+
+def _item_problem(item) -> Optional[InvoiceProcessingError]:
+    """
+    Normaliza y valida una línea; devuelve el error en lugar de lanzarlo.
+    """
+    if not isinstance(item, dict):
+        return InvalidJSONError("La línea no es un objeto JSON.")
+
+    try:
+        normalize_data_types(item)
+        validate_required_fields(item)
+        validate_amount_field(item)
+    except InvoiceProcessingError as e:
+        return e
+
+    return None
 
-    for page_index, page_text in enumerate(pages_text, start=1):
 
-        if not page_text.strip():
+def row_context(text: str, items: List[Dict[str, Any]]) -> str:
+    """
+    Cabecera de la página más las líneas de texto donde aparece algún
+    valor ya extraído de las líneas a corregir. Si no se localiza
+    ninguna, o el fragmento no ahorra nada, se usa la página completa.
+    """
+    lines = text.splitlines()
+    anchors = set()
+
+    for item in items:
+        for field in ("articulo", "numero_factura", "fecha", "cantidad"):
+            value = item.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                anchors.update({f"{value:.2f}".replace(".", ","), f"{value:.2f}"})
+            elif isinstance(value, str) and len(value.strip()) >= 3:
+                anchors.add(value.strip().lower())
+
+    keep = set(range(min(ROW_CONTEXT_HEADER_LINES, len(lines))))
+    found = False
+
+    for i, line in enumerate(lines):
+        lowered = line.lower()
+        if any(anchor in lowered for anchor in anchors):
+            found = True
+            keep.update(range(max(0, i - ROW_CONTEXT_MARGIN), min(len(lines), i + ROW_CONTEXT_MARGIN + 1)))
+
+    if not found or len(keep) >= len(lines):
+        return text
+
+    return "\n".join(lines[i] for i in sorted(keep))
+
+
+def validate_items_with_retry(
+    parsed_list,
+    text: str,
+    retry_budget: int = ROW_RETRY_BUDGET
+) -> List[Dict[str, Any]]:
+    """
+    Como validate_items, pero una línea inválida no descarta la página:
+    se conservan las líneas válidas y solo las que fallan se vuelven a
+    pedir al modelo (extract_invoice_lines), con el fragmento de texto
+    donde aparecen, hasta retry_budget peticiones.
+
+    Las líneas que siguen fallando se descartan; si no queda ninguna
+    válida se lanza el error de la primera, como hacía validate_items.
+    """
+    items = list(parsed_list)
+    problems = [_item_problem(item) for item in items]
+    attempts = 0
+
+    while any(problems) and attempts < retry_budget:
+        failing = [i for i, problem in enumerate(problems) if problem and isinstance(items[i], dict)]
+        if not failing:
+            break
+
+        attempts += 1
+        to_fix = [items[i] for i in failing]
+
+        try:
+            # A partir del segundo intento el prompt se repite: sin caché
+            raw_response = extract_invoice_lines(
+                row_context(text, to_fix),
+                [(items[i], str(problems[i])) for i in failing],
+                use_cache=attempts == 1
+            )
+            fixed = parse_and_record(raw_response)
+        except InvoiceProcessingError as e:
+            print(f"Reintento de {len(failing)} líneas no procesable ({e})")
             continue
 
+        if len(fixed) != len(failing):
+            print(f"Reintento de {len(failing)} líneas devolvió {len(fixed)}: se ignora")
+            continue
+
+        for i, new_item in zip(failing, fixed):
+            if isinstance(new_item, dict):
+                candidate = {**items[i], **new_item}
+                problem = _item_problem(candidate)
+                if problem is None:
+                    items[i], problems[i] = candidate, None
+
+    valid = [item for item, problem in zip(items, problems) if problem is None]
+    errors = [problem for problem in problems if problem is not None]
+
+    if errors:
+        if not valid:
+            raise errors[0]
+        print(f"{len(errors)} líneas descartadas tras {attempts} reintentos ({errors[0]})")
+
+    return valid
+
+
+def parse_and_record(raw_response: str):
+    """
+    parse_model_response registrando el resultado en las estadísticas
+    de fallos de parseo del modo de salida usado.
+    """
+    try:
+        parsed_list, parsed = _parse_lines(raw_response)
+    except InvalidJSONError:
+        record_parse_result(False)
+        raise
+
+    if parsed.repaired:
+        print(f"Respuesta JSON reparada ({', '.join(parsed.repairs)})")
+
+    record_parse_result(True, repaired=parsed.repaired)
+    return parsed_list
+
+
+def fill_from_text(items, text: str):
+    """
+    Completa "cif" y "fecha" que el modelo dejó vacíos con el valor que el
+    texto de la página determina sin ambigüedad (entity_scanner).
+    """
+    known = prefill_fields(text)
+
+    for item in items:
+        if isinstance(item, dict):
+            for field, value in known.items():
+                if not item.get(field):
+                    item[field] = value
+
+    return items
+
+
+def process_invoice_text(
+    text: str,
+    table_rows: Optional[List[Dict[str, str]]] = None
+) -> Dict[str, Any]:
+    # PDF digital en modo layout: líneas a partir de las filas por coordenadas
+    if table_rows:
+        layout_items = items_from_table_rows(text, table_rows)
+        if layout_items is not None:
+            return validate_items(layout_items)
+
+    # Formato conocido: se lee la tabla directamente, sin LLM
+    fast_items = parse_fuel_card_invoice(text)
+    if fast_items is not None:
+        return validate_items(fast_items)
+
+    # Una respuesta de la caché que ya no parsea o valida se pide de nuevo
+    # una vez sin caché, y la nueva la sustituye
+    for use_cache in (True, False):
+        raw_response = extract_invoice(text, use_cache=use_cache)
+        from_cache = last_response_cached()
+
         try:
-            invoice_items = process_invoice_text(page_text)
+            parsed_list = parse_and_record(raw_response)
+            return validate_items_with_retry(fill_from_text(parsed_list, text), text)
+        except InvoiceProcessingError as e:
+            if not from_cache:
+                raise
+            print(f"Respuesta en caché no válida ({e}): se pide de nuevo al modelo")
 
-            for item in invoice_items:
-                item["numero_orden"] = global_counter
-                invoices.append(item)
-                global_counter += 1
+
+# Máximo de páginas por petición en el modo por lotes, para que la
+# respuesta no crezca más allá de lo que el modelo devuelve con fiabilidad
+MAX_PAGES_PER_BATCH = 8
+
+
+def process_invoice_batch(
+    pages: List[Tuple[int, str]]
+) -> Dict[int, Union[List[Dict[str, Any]], InvoiceProcessingError]]:
+    """
+    Extrae varias páginas con una sola petición y reparte las líneas
+    por su campo "pagina".
+
+    Devuelve {página: líneas validadas} o la excepción de esa página.
+    Las páginas que el lote no resuelve limpiamente (respuesta no
+    parseable, páginas sin líneas, sin ninguna línea válida tras el
+    reintento por líneas o con una página desconocida) se reprocesan
+    individualmente con process_invoice_text, de modo que el resultado
+    coincide con el del modo página a página.
+    """
+    results: Dict[int, Union[List[Dict[str, Any]], InvoiceProcessingError]] = {}
+
+    # Las páginas con formato conocido no necesitan ir al modelo
+    for page_number, text in pages:
+        fast_items = parse_fuel_card_invoice(text)
+        if fast_items is not None:
+            results[page_number] = validate_items(fast_items)
+
+    pages = [(number, text) for number, text in pages if number not in results]
+    if not pages:
+        return results
+
+    texts = dict(pages)
+    by_page: Dict[int, List[Dict[str, Any]]] = {number: [] for number in texts}
+    unresolved = set()
+
+    try:
+        parsed_list = parse_and_record(extract_invoice_batch(pages))
+    except InvoiceProcessingError as e:
+        print(f"Lote de páginas {list(texts)} no procesable ({e}): se procesan por separado")
+        parsed_list = []
+        unresolved.update(texts)
+
+    for item in parsed_list:
+        page_number = item.pop("pagina", None) if isinstance(item, dict) else None
+
+        if page_number not in by_page:
+            print(f"Lote de páginas {list(texts)} con líneas sin página válida: se procesan por separado")
+            unresolved.update(texts)
+            break
+
+        by_page[page_number].append(item)
+
+    for page_number, items in by_page.items():
+        if page_number not in unresolved and items:
+            try:
+                results[page_number] = validate_items_with_retry(
+                    fill_from_text(items, texts[page_number]), texts[page_number]
+                )
+                continue
+            except InvoiceProcessingError:
+                pass
+
+        try:
+            results[page_number] = process_invoice_text(texts[page_number])
+        except InvoiceProcessingError as e:
+            results[page_number] = e
+
+    return results
+
+
+def iter_invoices(
+    pages_text: Iterable,
+    dedup: bool = True,
+    max_in_flight: int = 1,
+    batch_tokens: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Variante en streaming de process_multiple_invoices.
+
+    Consume las páginas a medida que llegan (p. ej. desde
+    ocr.iter_text_by_pages) y emite cada línea en cuanto el modelo
+    responde, de modo que el OCR de la página N+1 se solapa con la
+    llamada al LLM de la página N.
+
+    Las páginas pueden ser texto o ocr.PageResult (que aporta además el
+    hash de imagen y, en modo layout, las filas de la tabla de consumos,
+    de las que se construyen las líneas sin LLM). Con dedup, una página repetida no se envía al modelo:
+    se reutilizan las líneas de la primera copia, marcadas con
+    "duplicado_de_pagina".
+
+    max_in_flight > 1 envía hasta ese número de peticiones al modelo en
+    paralelo. Las líneas se emiten siempre en el orden de las páginas y
+    numero_orden se asigna secuencialmente sobre ese orden final.
+
+    batch_tokens agrupa páginas consecutivas en una misma petición
+    (process_invoice_batch) mientras su texto no supere ese presupuesto
+    de tokens; una página que lo supera por sí sola va en solitario.
+    """
+    global_counter = 1  # numeración real por línea
+    deduplicator = PageDeduplicator() if dedup else None
+    items_by_page: Dict[int, List[Dict[str, Any]]] = {}
+
+    # [página, página original si es duplicada, future de la extracción,
+    #  True si el future es de un lote]. El future queda a None en las
+    # duplicadas y en las páginas del lote que aún no se ha enviado.
+    pending = deque()
+    batch = []
+    batch_size = 0
+
+    def resolve(page_index, original, future, batched) -> List[Dict[str, Any]]:
+        if original is not None:
+            print(f"Página {page_index} duplicada de la página {original}: se reutiliza su extracción")
+            return [
+                {**item, "duplicado_de_pagina": original}
+                for item in items_by_page.get(original, [])
+            ]
+
+        try:
+            invoice_items = future.result()
+
+            if batched:
+                invoice_items = invoice_items[page_index]
+                if isinstance(invoice_items, InvoiceProcessingError):
+                    raise invoice_items
 
         except InvoiceProcessingError as e:
             print(f"Error en página {page_index}: {e}")
-            continue
+            return []
+
+        if deduplicator:
+            items_by_page[page_index] = [dict(item) for item in invoice_items]
+
+        return invoice_items
+
+    def in_flight() -> int:
+        return len({id(entry[2]) for entry in pending if entry[2] is not None})
 
-    return invoices
+    def ready() -> bool:
+        return pending[0][1] is not None or pending[0][2] is not None
+
+    def flush_batch() -> None:
+        nonlocal batch, batch_size
+        if len(batch) == 1:
+            entry, page_text = batch[0]
+            entry[2] = executor.submit(process_invoice_text, page_text)
+        elif batch:
+            future = executor.submit(
+                process_invoice_batch,
+                [(entry[0], page_text) for entry, page_text in batch]
+            )
+            for entry, _ in batch:
+                entry[2] = future
+                entry[3] = True
+        batch, batch_size = [], 0
+
+    with ThreadPoolExecutor(max_workers=max(1, max_in_flight)) as executor:
+        for page_index, page in enumerate(pages_text, start=1):
+            page_text, image_hash = page_text_and_hash(page)
+            table_rows = getattr(page, "table_rows", None)
+
+            if not page_text.strip():
+                continue
+
+            original = deduplicator.check(page_index, page_text, image_hash) if deduplicator else None
+
+            if original is not None:
+                pending.append([page_index, original, None, False])
+
+            elif batch_tokens and not table_rows:
+                tokens = estimate_tokens(page_text)
+                if batch and batch_size + tokens > batch_tokens:
+                    flush_batch()
+
+                entry = [page_index, None, None, False]
+                pending.append(entry)
+                batch.append((entry, page_text))
+                batch_size += tokens
+
+                if batch_size >= batch_tokens or len(batch) >= MAX_PAGES_PER_BATCH:
+                    flush_batch()
+
+            else:
+                pending.append([
+                    page_index, None,
+                    executor.submit(process_invoice_text, page_text, table_rows), False
+                ])
+
+            # Al alcanzar el límite se espera a la página más antigua,
+            # lo que además conserva el orden de salida
+            while pending and ready() and (in_flight() >= max_in_flight or pending[0][2] is None):
+                for item in resolve(*pending.popleft()):
+                    item["numero_orden"] = global_counter
+                    global_counter += 1
+                    yield item
+
+        flush_batch()
+
+        while pending:
+            for item in resolve(*pending.popleft()):
+                item["numero_orden"] = global_counter
+                global_counter += 1
+                yield item
+
+
+def process_multiple_invoices(
+    pages_text: Iterable,
+    dedup: bool = True,
+    max_in_flight: int = 1,
+    batch_tokens: Optional[int] = None
+) -> List[Dict[str, Any]]:
+    return list(iter_invoices(
+        pages_text,
+        dedup=dedup,
+        max_in_flight=max_in_flight,
+        batch_tokens=batch_tokens
+    ))
@@ -0,0 +1,226 @@
+"""
+inventory_dedup.py
+
+Fusión de bienes duplicados del inventario de una escritura.
+
+El mismo inmueble puede aparecer varias veces en el resultado de
+deed_validator: descrito en el inventario y de nuevo en las
+adjudicaciones, o extraído desde dos chunks. Dos bienes se consideran el
+mismo si:
+- Comparten alguna referencia catastral (coincidencia exacta).
+- Sus descripciones son casi idénticas (Jaccard de shingles de palabras
+  >= MERGE_THRESHOLD) y no se contradicen: las cifras de una están
+  contenidas en las de la otra (dos plazas de garaje de la misma
+  promoción solo difieren en el número), no tienen referencias
+  catastrales distintas y no tienen regímenes distintos.
+
+Los candidatos por descripción se obtienen con MinHash + LSH por bandas,
+de modo que el coste es lineal en el número de bienes en lugar de
+comparar todos los pares.
+"""
+
+import re
+import unicodedata
+import zlib
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+SHINGLE_WORDS = 3          # palabras por shingle
+NUM_PERM = 64              # permutaciones de la firma MinHash
+BANDS = 16                 # 16 bandas x 4 filas: candidatos desde Jaccard ~0.5
+MERGE_THRESHOLD = 0.8      # Jaccard exacto mínimo para fusionar por descripción
+
+_PRIME = 4294967311        # primo > 2**32
+_rng = np.random.default_rng(2026)  # semilla fija: resultado reproducible
+_A = _rng.integers(1, _PRIME, NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERM, dtype=np.uint64)
+
+
+def _normalized_words(text: str) -> List[str]:
+    """
+    Palabras en minúsculas y sin tildes.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.findall(r"\w+", text.casefold())
+
+
+def shingles(text: str) -> Set[str]:
+    words = _normalized_words(text)
+
+    if len(words) < SHINGLE_WORDS:
+        return {" ".join(words)} if words else set()
+
+    return {
+        " ".join(words[i:i + SHINGLE_WORDS])
+        for i in range(len(words) - SHINGLE_WORDS + 1)
+    }
+
+
+def minhash(shingle_set: Set[str]) -> np.ndarray:
+    """
+    Firma MinHash de NUM_PERM valores para un conjunto de shingles.
+    """
+    hashes = np.fromiter(
+        (zlib.crc32(s.encode("utf-8")) for s in shingle_set),
+        dtype=np.uint64,
+        count=len(shingle_set)
+    )
+    return ((np.outer(_A, hashes) + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def _numbers(text: str) -> Set[str]:
+    return set(re.findall(r"\d+", text))
+
+
+def _refs(item: Dict[str, Any]) -> List[str]:
+    refs = item.get("referencias_catastrales") or []
+    return [ref.strip().upper() for ref in refs if isinstance(ref, str) and ref.strip()]
+
+
+def _known_regimen(item: Dict[str, Any]) -> Optional[str]:
+    regimen = item.get("regimen")
+    return regimen if regimen in ("ganancial", "privativo") else None
+
+
+class _UnionFind:
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a: int, b: int) -> None:
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            # La raíz es siempre el bien que aparece antes
+            self.parent[max(a, b)] = min(a, b)
+
+
+def merge_duplicate_items(
+    items: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Tuple[int, List[Tuple[Dict[str, Any], str]]]]]:
+    """
+    Fusiona los bienes duplicados conservando la primera aparición.
+
+    El bien conservado suma las referencias catastrales de sus duplicados
+    y toma el régimen de alguno de ellos si el suyo es desconocido.
+
+    Devuelve (bienes resultantes en el orden original,
+    [(posición del bien conservado, [(bien fusionado, motivo)])]),
+    con motivo "referencia_catastral" o "descripcion".
+    """
+    uf = _UnionFind(len(items))
+
+    # Coincidencia exacta de referencias catastrales
+    by_ref: Dict[str, int] = {}
+    for i, item in enumerate(items):
+        for ref in _refs(item):
+            if ref in by_ref:
+                uf.union(by_ref[ref], i)
+            else:
+                by_ref[ref] = i
+
+    # Descripciones casi idénticas: candidatos por LSH, verificados con
+    # Jaccard exacto y las reglas de compatibilidad
+    shingle_sets = []
+    numbers = []
+    buckets: Dict[Tuple[int, bytes], List[int]] = {}
+    rows = NUM_PERM // BANDS
+
+    for i, item in enumerate(items):
+        description = item.get("descripcion")
+        description = description if isinstance(description, str) else ""
+        shingle_sets.append(shingles(description))
+        numbers.append(_numbers(description))
+
+        if not shingle_sets[i]:
+            continue
+
+        signature = minhash(shingle_sets[i])
+        compared = set()
+
+        # Se compara con todos los bienes anteriores de cada cubo, no solo
+        # con el primero: un casi duplicado anterior (otra plaza del mismo
+        # garaje) no debe ocultar al duplicado exacto que llega después
+        for band in range(BANDS):
+            key = (band, signature[band * rows:(band + 1) * rows].tobytes())
+            members = buckets.setdefault(key, [])
+
+            for other in members:
+                if other in compared:
+                    continue
+                compared.add(other)
+
+                if uf.find(other) == uf.find(i):
+                    continue
+
+                if _same_property(items[other], items[i], shingle_sets[other], shingle_sets[i],
+                                  numbers[other], numbers[i]):
+                    uf.union(other, i)
+
+            members.append(i)
+
+    # Agrupar y fusionar en el primer bien de cada grupo
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(items)):
+        groups.setdefault(uf.find(i), []).append(i)
+
+    merged_items = []
+    merges = []
+
+    for root in sorted(groups):
+        members = groups[root]
+        kept = dict(items[root])
+
+        if len(members) > 1:
+            kept_refs = set(_refs(kept))
+            absorbed = []
+
+            for i in members[1:]:
+                duplicate = items[i]
+                reason = "referencia_catastral" if kept_refs & set(_refs(duplicate)) else "descripcion"
+                absorbed.append((duplicate, reason))
+
+                refs = list(kept.get("referencias_catastrales") or [])
+                for ref in _refs(duplicate):
+                    if ref not in kept_refs:
+                        refs.append(ref)
+                        kept_refs.add(ref)
+                kept["referencias_catastrales"] = refs
+
+                if _known_regimen(kept) is None and _known_regimen(duplicate):
+                    kept["regimen"] = duplicate["regimen"]
+
+            merges.append((len(merged_items), absorbed))
+
+        merged_items.append(kept)
+
+    return merged_items, merges
+
+
+def _same_property(a, b, shingles_a, shingles_b, numbers_a, numbers_b) -> bool:
+    if _jaccard(shingles_a, shingles_b) < MERGE_THRESHOLD:
+        return False
+
+    if not (numbers_a <= numbers_b or numbers_b <= numbers_a):
+        return False
+
+    refs_a, refs_b = set(_refs(a)), set(_refs(b))
+    if refs_a and refs_b and not refs_a & refs_b:
+        return False
+
+    regimen_a, regimen_b = _known_regimen(a), _known_regimen(b)
+    if regimen_a and regimen_b and regimen_a != regimen_b:
+        return False
+
+    return True
@@ -1,4 +1,10 @@
-from openai import OpenAI
+import json
+import os
+import threading
+
+from openai import BadRequestError, OpenAI, UnprocessableEntityError
+
+from disk_cache import DiskCache, default_cache_dir, make_key
 
 #modelo = "qwen2.5-7b-instruct-1m"
 modelo = "google/gemma-3-4b"
@@ -8,6 +14,303 @@ client = OpenAI(
     api_key="lm-studio"
 )
 
+# Peticiones simultáneas que admite el servidor de inferencia
+# (LM Studio: ajustar a los "parallel slots" configurados)
+MAX_CONCURRENT_REQUESTS = 4
+
+# Versión de las plantillas de prompt: incrementarla invalida la caché
+# aunque el texto del prompt no cambie (p. ej. cambios en el parseo)
+PROMPT_VERSION = "1"
+
+# Caché persistente de respuestas: con temperature=0 la respuesta es
+# reproducible, así que reprocesar un documento sin cambios no llama al modelo.
+# LLM_CACHE_DISABLED=1 la desactiva por completo.
+llm_cache = None
+if not os.environ.get("LLM_CACHE_DISABLED"):
+    llm_cache = DiskCache(os.path.join(default_cache_dir(), "llm_cache.sqlite"))
+
+
+def clear_llm_cache():
+    """Invalida todas las respuestas cacheadas."""
+    if llm_cache is not None:
+        llm_cache.clear()
+
+
+def llm_cache_stats():
+    return llm_cache.stats() if llm_cache is not None else {}
+
+
+# Ventana de contexto del modelo cargado en el servidor, en tokens
+# (LM Studio: "Context Length" del modelo)
+CONTEXT_WINDOW = int(os.environ.get("LLM_CONTEXT_WINDOW", "4096"))
+
+# Caracteres por token aproximados para texto en castellano, usados hasta
+# que haya datos de calibración
+CHARS_PER_TOKEN = 3.5
+
+# Caracteres de prompt observados antes de fiarse de la ratio calibrada
+MIN_CALIBRATION_CHARS = 20_000
+
+# Tokenizador exacto opcional: LLM_TOKENIZER apunta al tokenizer.json
+# (Hugging Face) del modelo servido
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # opcional: sin él se usa la ratio caracteres/token
+    Tokenizer = None
+
+_tokenizer = None
+if Tokenizer is not None and os.environ.get("LLM_TOKENIZER"):
+    _tokenizer = Tokenizer.from_file(os.environ["LLM_TOKENIZER"])
+
+_usage_lock = threading.Lock()
+_observed_usage = [0, 0]  # [caracteres de prompt, tokens de prompt]
+
+
+def chars_per_token():
+    """
+    Ratio caracteres/token calibrada con los prompt_tokens que informa el
+    servidor en cada respuesta; CHARS_PER_TOKEN mientras no hay datos.
+
+    Cambia con cada respuesta nueva: quien trocea un documento debe leerla
+    una sola vez al empezar y pasarla a estimate_tokens(ratio=...), para
+    que los cortes no dependan del orden en que llegan las respuestas.
+    """
+    with _usage_lock:
+        chars, tokens = _observed_usage
+
+    if chars < MIN_CALIBRATION_CHARS or not tokens:
+        return CHARS_PER_TOKEN
+
+    return chars / tokens
+
+
+def _observe_usage(prompt, response):
+    usage = getattr(response, "usage", None)
+    prompt_tokens = getattr(usage, "prompt_tokens", None)
+
+    if prompt_tokens:
+        with _usage_lock:
+            _observed_usage[0] += len(prompt)
+            _observed_usage[1] += prompt_tokens
+
+
+def estimate_tokens(text, ratio=None):
+    """
+    Número de tokens de un texto: exacto con el tokenizador del modelo si
+    está configurado, estimado con la ratio caracteres/token si no (ratio
+    fija si se indica, la calibrada en este momento si no).
+    """
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text).ids)
+
+    return int(len(text) / (ratio or chars_per_token())) + 1
+
+
+# Salida JSON restringida por esquema (response_format json_schema): el
+# servidor solo puede generar JSON que cumpla el esquema. "auto" la usa
+# mientras el servidor la acepte y vuelve al modo solo-prompt si la
+# rechaza; "off" usa siempre el modo solo-prompt.
+STRUCTURED_OUTPUT = os.environ.get("LLM_STRUCTURED_OUTPUT", "auto")
+
+_structured_supported = True
+_local = threading.local()
+
+_stats_lock = threading.Lock()
+_parse_stats = {"json_schema": [0, 0, 0], "prompt": [0, 0, 0]}  # [respuestas, fallos, reparadas]
+
+
+def _nullable(json_type):
+    return {"type": [json_type, "null"]}
+
+
+_INVOICE_LINE_PROPERTIES = {
+    "numero_orden": _nullable("string"),
+    "numero_factura": _nullable("string"),
+    "fecha": _nullable("string"),
+    "cif": _nullable("string"),
+    "proveedor": _nullable("string"),
+    "comunidad_autonoma": _nullable("string"),
+    "articulo": _nullable("string"),
+    "cantidad": _nullable("number"),
+}
+
+
+def _lines_schema(properties):
+    # La raíz debe ser un objeto: las líneas van en "lineas"
+    return {
+        "type": "object",
+        "properties": {
+            "lineas": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": properties,
+                    "required": list(properties),
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["lineas"],
+        "additionalProperties": False,
+    }
+
+
+INVOICE_SCHEMA = _lines_schema(_INVOICE_LINE_PROPERTIES)
+
+INVOICE_BATCH_SCHEMA = _lines_schema(
+    {"pagina": {"type": "integer"}, **_INVOICE_LINE_PROPERTIES}
+)
+
+DEED_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "inventario": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "tipo": {"type": "string"},
+                    "descripcion": _nullable("string"),
+                    "referencias_catastrales": {
+                        "type": "array",
+                        "items": {"type": "string"},
+                    },
+                    "regimen": {"enum": ["ganancial", "privativo", "desconocido"]},
+                },
+                "required": ["tipo", "descripcion", "referencias_catastrales", "regimen"],
+                "additionalProperties": False,
+            },
+        },
+        "alertas": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["inventario", "alertas"],
+    "additionalProperties": False,
+}
+
+
+def _response_format(name, schema):
+    if schema is None or STRUCTURED_OUTPUT == "off" or not _structured_supported:
+        return None
+
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema},
+    }
+
+
+def last_response_mode():
+    """
+    Modo ("json_schema" o "prompt") de la última respuesta obtenida por
+    _chat en el hilo actual.
+    """
+    return getattr(_local, "mode", "prompt")
+
+
+def last_response_cached():
+    """
+    Si la última respuesta de _chat en el hilo actual salió de la caché.
+    Quien no pueda usarla debe pedir otra con use_cache=False, que la
+    sustituye; si no, la misma respuesta inválida se serviría siempre.
+    """
+    return getattr(_local, "cached", False)
+
+
+def record_parse_result(ok, mode=None, repaired=False):
+    """
+    Registra si la respuesta del modelo se pudo parsear, por modo de salida.
+    repaired indica que solo se pudo parsear tras repararla (llm_json).
+    """
+    with _stats_lock:
+        counts = _parse_stats[mode or last_response_mode()]
+        counts[0] += 1
+        if not ok:
+            counts[1] += 1
+        elif repaired:
+            counts[2] += 1
+
+
+def parse_failure_stats():
+    """
+    Respuestas, fallos de parseo, respuestas reparadas y tasa de fallo
+    por modo de salida.
+    """
+    with _stats_lock:
+        return {
+            mode: {
+                "respuestas": total,
+                "fallos": failed,
+                "reparadas": repaired,
+                "tasa_fallo": failed / total if total else 0.0,
+            }
+            for mode, (total, failed, repaired) in _parse_stats.items()
+        }
+
+
+# Fragmentos que identifican un error del servidor causado por response_format
+_RESPONSE_FORMAT_ERROR_MARKERS = ("response_format", "json_schema", "structured output")
+
+
+def _is_response_format_error(error):
+    details = f"{error} {getattr(error, 'body', '') or ''}".lower()
+    return any(marker in details for marker in _RESPONSE_FORMAT_ERROR_MARKERS)
+
+
+def _chat(prompt, temperature=0, use_cache=True, schema=None, schema_name="respuesta"):
+    """
+    Llamada al modelo con caché por (modelo, prompt, temperatura, versión
+    y response_format si lo hay).
+    use_cache=False fuerza una llamada nueva, cuyo resultado sustituye
+    al que hubiera en caché.
+
+    Con schema se pide salida JSON restringida; si el servidor rechaza el
+    response_format se repite la llamada en modo solo-prompt y no se
+    vuelve a intentar en esta ejecución. Cualquier otro error se propaga.
+    """
+    global _structured_supported
+
+    response_format = _response_format(schema_name, schema)
+
+    key_parts = ["chat", modelo, prompt, temperature, PROMPT_VERSION]
+    if response_format is not None:
+        key_parts.append(response_format)
+    key = make_key(*key_parts)
+
+    _local.mode = "json_schema" if response_format is not None else "prompt"
+    _local.cached = False
+
+    if llm_cache is not None and use_cache:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            _local.cached = True
+            return cached
+
+    kwargs = {}
+    if response_format is not None:
+        kwargs["response_format"] = response_format
+
+    try:
+        response = client.chat.completions.create(
+            model = modelo,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            **kwargs
+        )
+    except (BadRequestError, UnprocessableEntityError) as e:
+        # Solo un rechazo del propio response_format desactiva el modo con
+        # esquema; otros 400/422 (p. ej. prompt mayor que el contexto) no
+        if response_format is None or not _is_response_format_error(e):
+            raise
+        _structured_supported = False
+        return _chat(prompt, temperature=temperature, use_cache=use_cache)
+
+    _observe_usage(prompt, response)
+    content = response.choices[0].message.content
+
+    if llm_cache is not None and content:
+        llm_cache.set(key, content)
+
+    return content
+
 # Test: conectar con lm studio
 def test_connection():
     response = client.chat.completions.create(
@@ -20,8 +323,33 @@ def test_connection():
     
     print(response.choices[0].message.content)
 
+# Reglas de extracción comunes a los prompts de facturas
+_INVOICE_RULES = """\
+    Reglas para "cantidad":
+    - En cada línea de consumo, la tabla sigue esta estructura:
+        - Ref. Fecha / Hora Producto Establecimiento Matrícula Km Cantidad P.Un. Dto. Importe
+        - La "cantidad" es el valor numérico situado inmediatamente antes de la columna "P.Un.".
+    - No debe formar parte del nombre del producto (ejemplo: "Gasol 5").
+    - Copiar EXACTAMENTE el signo que aparece en el texto.
+    - Ignorar números entre corchetes [ ].
+    - Si no hay símbolo "-" delante del número, la cantidad es positiva.
+    - No inferir signos negativos.
+    Es decir:
+    - Es el número que aparece justo antes del precio unitario.
+    - No es el precio unitario.
+    - No es el descuento.
+    - No es el importe final.
+    - Ignorar números que aparezcan en secciones como:
+        "Totales", "Resumen de Carburantes", "Desglose de Impuestos".
+    - La cantidad debe extraerse exclusivamente de la línea de consumo individual.
+
+    Reglas para "fecha":
+    - Formato obligatorio YYYY-MM-DD.
+    - Si aparece en formato DD/MM/YYYY o DD-MM-YYYY, convertirlo."""
+
+
 # Extraer datos de factura
-def extract_invoice(text):
+def extract_invoice(text, use_cache=True):
     prompt = f"""
     Eres un sistema experto en análisis documental jurídico-contable.
 
@@ -61,43 +389,100 @@ def extract_invoice(text):
     - Si un dato no aparece, usar null.
     - No inventar datos.
 
-    Reglas para "cantidad":
-    - En cada línea de consumo, la tabla sigue esta estructura:
-        - Ref. Fecha / Hora Producto Establecimiento Matrícula Km Cantidad P.Un. Dto. Importe
-        - La "cantidad" es el valor numérico situado inmediatamente antes de la columna "P.Un.".
-    - No debe formar parte del nombre del producto (ejemplo: "Gasol 5").
-    - Copiar EXACTAMENTE el signo que aparece en el texto.
-    - Ignorar números entre corchetes [ ].
-    - Si no hay símbolo "-" delante del número, la cantidad es positiva.
-    - No inferir signos negativos.
-    Es decir:
-    - Es el número que aparece justo antes del precio unitario.
-    - No es el precio unitario.
-    - No es el descuento.
-    - No es el importe final.
-    - Ignorar números que aparezcan en secciones como:
-        "Totales", "Resumen de Carburantes", "Desglose de Impuestos".
-    - La cantidad debe extraerse exclusivamente de la línea de consumo individual.
-
-    Reglas para "fecha":
-    - Formato obligatorio YYYY-MM-DD.
-    - Si aparece en formato DD/MM/YYYY o DD-MM-YYYY, convertirlo.
+{_INVOICE_RULES}
 
     Texto de la factura:
     {text}
     """
 
-    response = client.chat.completions.create(
-        model = modelo,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
+    return _chat(prompt, use_cache=use_cache, schema=INVOICE_SCHEMA, schema_name="factura")
+
+
+# Presupuesto de tokens de texto de página por petición en el modo por
+# lotes de facturas (None = una petición por página)
+INVOICE_BATCH_TOKENS = None
+
+
+def extract_invoice_batch(pages, use_cache=True):
+    """
+    Extrae las líneas de varias páginas en una sola petición.
+
+    pages es una lista de (número de página, texto). El bloque de
+    instrucciones se envía una única vez y cada línea devuelta incluye
+    el campo "pagina" con su página de origen.
+    """
+    delimited = "\n".join(
+        f"=== PÁGINA {number} ===\n{text}\n=== FIN PÁGINA {number} ==="
+        for number, text in pages
     )
 
-    return response.choices[0].message.content
+    prompt = f"""
+    Eres un sistema experto en análisis documental jurídico-contable.
+
+    Analiza los siguientes textos extraídos de VARIAS páginas de facturas.
+    Cada página empieza con "=== PÁGINA N ===" y termina con "=== FIN PÁGINA N ===".
+
+    Devuelve EXCLUSIVAMENTE un ARRAY JSON válido.
+    No escribas explicaciones.
+    No escribas texto adicional.
+    No uses comillas triples.
+    No añadas comentarios.
+    Devuelve solo el array JSON.
+    Cada elemento del array debe representar una línea de factura.
+
+    Formato obligatorio de salida (respetar exactamente esta estructura):
+
+    [
+        {{
+            "pagina": number,
+            "numero_orden": string | null,
+            "numero_factura": string | null,
+            "fecha": string | null,
+            "cif": string | null,
+            "proveedor": string | null,
+            "comunidad_autonoma": string | null,
+            "articulo": string | null,
+            "cantidad": number | null
+        }}
+    ]
+
+    Reglas estrictas:
+
+    - El resultado debe ser SIEMPRE un único array con las líneas de todas las páginas.
+    - "pagina" es el número N de la página de la que procede la línea.
+    - Procesar cada página de forma independiente: no mezclar datos de páginas distintas.
+    - Si una página contiene varias líneas de producto, generar un objeto por cada línea.
+    - No incluir texto fuera del JSON.
+    - No incluir campos adicionales.
+    - Si un dato no aparece, usar null.
+    - No inventar datos.
+
+{_INVOICE_RULES}
+
+    Páginas:
+    {delimited}
+    """
+
+    return _chat(prompt, use_cache=use_cache, schema=INVOICE_BATCH_SCHEMA, schema_name="facturas_lote")
+
+
+# Tokens reservados para la respuesta de cada chunk de escritura: el
+# modelo copia la descripción completa de cada finca
+DEED_OUTPUT_TOKENS = 1536
+
+
+def extract_deed_chunk(chunk, use_cache=True):
+    prompt = _deed_prompt(chunk)
+    return _chat(prompt, use_cache=use_cache, schema=DEED_SCHEMA, schema_name="inventario_escritura")
 
 
-def extract_deed_chunk(chunk):
-    prompt = rf"""
+def deed_prompt_overhead(ratio=None):
+    """Tokens del prompt de escrituras sin el texto del chunk."""
+    return estimate_tokens(_deed_prompt(""), ratio)
+
+
+def _deed_prompt(chunk):
+    return rf"""
     Eres un sistema experto en análisis de escrituras notariales españolas.
 
     Tu tarea es extraer EXCLUSIVAMENTE bienes inmuebles del inventario.
@@ -186,10 +571,60 @@ def extract_deed_chunk(chunk):
     {chunk}
     """
     #- No crear un elemento en "inventario" a partir de una adjudicación o cuota.
-    response = client.chat.completions.create(
-        model = modelo,
-        messages=[{"role": "user", "content": prompt}],
-        temperature=0
+
+def extract_invoice_lines(text, lines, use_cache=True):
+    """
+    Vuelve a pedir solo las líneas de una factura que no pasaron la
+    validación, en lugar de la página entera.
+
+    lines es una lista de (línea tal como se extrajo, problema detectado);
+    text puede ser solo el fragmento de la página donde aparecen. La
+    respuesta trae las mismas líneas, completas y en el mismo orden.
+    """
+    failing = "\n".join(
+        f"    {index}. {json.dumps(line, ensure_ascii=False)}  -> {problem}"
+        for index, (line, problem) in enumerate(lines, start=1)
     )
 
-    return response.choices[0].message.content
\ No newline at end of file
+    prompt = f"""
+    Eres un sistema experto en análisis documental jurídico-contable.
+
+    De la factura siguiente ya se extrajeron estas líneas, pero tienen
+    campos que faltan o no son válidos:
+
+{failing}
+
+    Vuelve a leer el texto y devuelve EXCLUSIVAMENTE un ARRAY JSON válido
+    con esas mismas {len(lines)} líneas corregidas, en el mismo orden.
+    No escribas explicaciones.
+    No escribas texto adicional.
+    Devuelve solo el array JSON.
+
+    Formato obligatorio de cada elemento:
+
+        {{
+            "numero_orden": string | null,
+            "numero_factura": string | null,
+            "fecha": string | null,
+            "cif": string | null,
+            "proveedor": string | null,
+            "comunidad_autonoma": string | null,
+            "articulo": string | null,
+            "cantidad": number | null
+        }}
+
+    Reglas estrictas:
+
+    - Incluir todos los campos en cada línea.
+    - Mantener los valores que ya son correctos.
+    - Si un dato no aparece, usar null.
+    - No inventar datos.
+    - No añadir líneas nuevas.
+
+{_INVOICE_RULES}
+
+    Texto de la factura:
+    {text}
+    """
+
+    return _chat(prompt, use_cache=use_cache, schema=INVOICE_SCHEMA, schema_name="factura_lineas")
@@ -0,0 +1,200 @@
+"""
+llm_json.py
+
+Parseo tolerante de las respuestas JSON del modelo, común a facturas
+(envoice_processor) y escrituras (deed_validator).
+
+Cada respuesta cuesta una llamada completa al LLM, así que en lugar de
+descartarla ante el primer error se recupera todo lo que se pueda:
+1. Se quita el bloque markdown (```json ... ```).
+2. Se decodifica el primer valor JSON con JSONDecoder.raw_decode, que
+   ignora el texto que el modelo añada antes o después.
+3. Si falla, se eliminan las comas finales (`[1, 2,]`) y, si la respuesta
+   está cortada, se recorta tras el último elemento completo de un array
+   y se cierran los corchetes y llaves abiertos.
+4. Como último recurso se recogen todos los objetos {...} completos que
+   aparezcan sueltos en el texto.
+
+El resultado indica qué reparaciones se aplicaron.
+"""
+
+import json
+import re
+from dataclasses import dataclass, field
+from typing import Any, List, Optional, Tuple
+
+
+# Nombres de las reparaciones que se informan en ParsedJSON.repairs
+REPAIR_MARKDOWN = "markdown"
+REPAIR_TRAILING_COMMAS = "comas_finales"
+REPAIR_TRUNCATED = "truncado"
+REPAIR_EXTRA_VALUES = "valores_adicionales"
+REPAIR_LOOSE_OBJECTS = "objetos_sueltos"
+
+_decoder = json.JSONDecoder()
+
+_CODE_FENCE = re.compile(r"```[a-zA-Z]*\s*(.*?)(?:```|$)", re.DOTALL)
+
+_CLOSING = {"{": "}", "[": "]"}
+
+_CLOSE_AHEAD = re.compile(r"\s*[}\]]")
+
+
+@dataclass
+class ParsedJSON:
+    data: Any = None                            # None si no se recuperó nada
+    repairs: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return self.data is not None
+
+    @property
+    def repaired(self) -> bool:
+        """Se reparó el contenido; quitar el bloque markdown no cuenta."""
+        return self.ok and any(repair != REPAIR_MARKDOWN for repair in self.repairs)
+
+
+def _strip_trailing_commas(text: str) -> str:
+    """
+    Elimina las comas seguidas solo de espacios y un cierre, fuera de strings.
+    """
+    result = []
+    in_string = escaped = False
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == "," and _CLOSE_AHEAD.match(text, i + 1):
+            continue
+        result.append(char)
+
+    return "".join(result)
+
+
+def _close_truncated(text: str) -> Optional[str]:
+    """
+    Recorta tras el último elemento completo de un array (o tras el valor
+    completo de primer nivel) y cierra los contenedores abiertos.
+    None si no hay ningún elemento completo.
+    """
+    stack = []
+    in_string = escaped = False
+    cut: Optional[Tuple[int, str]] = None
+
+    for i, char in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char in _CLOSING:
+            stack.append(char)
+        elif char in ("}", "]"):
+            if not stack:
+                break
+            stack.pop()
+            if not stack or stack[-1] == "[":
+                cut = (i + 1, "".join(_CLOSING[c] for c in reversed(stack)))
+            if not stack:
+                break
+
+    if cut is None:
+        return None
+
+    position, closing = cut
+    return text[:position] + closing
+
+
+def _decode(text: str, start: int) -> Optional[Tuple[Any, int]]:
+    try:
+        return _decoder.raw_decode(text, start)
+    except json.JSONDecodeError:
+        return None
+
+
+def _loose_objects(text: str, start: int = 0) -> List[Any]:
+    """
+    Todos los objetos {...} completos del texto, de izquierda a derecha y
+    sin solaparse.
+    """
+    objects = []
+    position = text.find("{", start)
+
+    while position != -1:
+        decoded = _decode(text, position)
+        if decoded is not None:
+            objects.append(decoded[0])
+            position = text.find("{", decoded[1])
+        else:
+            position = text.find("{", position + 1)
+
+    return objects
+
+
+def parse_llm_json(text: Optional[str]) -> ParsedJSON:
+    """
+    Recupera el JSON de una respuesta del modelo. Si tras el primer valor
+    vienen más valores completos, se devuelven todos en una lista.
+    """
+    result = ParsedJSON()
+    if not text or not text.strip():
+        return result
+
+    text = text.strip()
+
+    fence = _CODE_FENCE.search(text)
+    if fence:
+        text = fence.group(1).strip()
+        result.repairs.append(REPAIR_MARKDOWN)
+
+    starts = [i for i in (text.find("["), text.find("{")) if i != -1]
+    if not starts:
+        return result
+    body = text[min(starts):]
+
+    # Valor completo, sin comas finales o cerrado tras el último elemento
+    decoded = _decode(body, 0)
+    if decoded is None:
+        without_commas = _strip_trailing_commas(body)
+        decoded = _decode(without_commas, 0)
+        if decoded is not None:
+            result.repairs.append(REPAIR_TRAILING_COMMAS)
+            body = without_commas
+        else:
+            closed = _close_truncated(without_commas)
+            decoded = _decode(closed, 0) if closed else None
+            if decoded is not None:
+                if without_commas != body:
+                    result.repairs.append(REPAIR_TRAILING_COMMAS)
+                result.repairs.append(REPAIR_TRUNCATED)
+                body = closed
+
+    if decoded is None:
+        objects = _loose_objects(body)
+        if objects:
+            result.data = objects
+            result.repairs.append(REPAIR_LOOSE_OBJECTS)
+        return result
+
+    data, end = decoded
+
+    # Varios valores seguidos ({...}\n{...}): se conservan todos
+    extra = _loose_objects(body, end)
+    if extra:
+        data = (data if isinstance(data, list) else [data]) + extra
+        result.repairs.append(REPAIR_EXTRA_VALUES)
+
+    result.data = data
+    return result
@@ -4,12 +4,38 @@
 
 #####Ojo, esto no funciona si la factura ocupa dos paginas o hay dos facturas en una misma página####
 
+import gc
+import json
+import logging
+import math
+import os
+import queue
 import re
-from typing import List
+import tempfile
+import threading
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import numpy as np
 import pdfplumber
+import pypdfium2
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageDraw
+
+try:
+    import tesserocr
+except ImportError:  # optional: persistent in-process engine
+    tesserocr = None
+
+try:
+    import psutil
+except ImportError:  # optional: RSS measurement outside Linux
+    psutil = None
+
+from disk_cache import DiskCache, file_sha256, make_key
 
 
 SUPPORTED_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
@@ -18,11 +44,226 @@ SUPPORTED_PDF_EXTENSIONS = (".pdf",)
 pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
 
 
+logger = logging.getLogger(__name__)
+
+
 class OCRExtractionError(Exception):
     """Custom exception for OCR extraction errors."""
     pass
 
 
+@dataclass
+class PageResult:
+    """
+    Extraction result for a single page.
+
+    A failed page keeps its position with empty text and the error message,
+    so one bad page does not abort the whole document.
+    """
+    page_number: int
+    text: str
+    error: Optional[str] = None
+    from_cache: bool = False
+    method: Optional[str] = None            # "text" (text layer) | "ocr" | "regions"
+    resolution: Optional[int] = None        # dpi finally used for OCR
+    confidence: Optional[float] = None      # mean Tesseract word confidence (adaptive mode)
+    image_hash: Optional[str] = None        # perceptual hash of the rendered page (OCR pages)
+    table_rows: Optional[List[Dict[str, str]]] = None  # layout mode: rows of the settings.table_columns table
+
+
+@dataclass(frozen=True)
+class OCRSettings:
+    """
+    Settings that change the extracted text.
+
+    They are part of the OCR cache key: changing any of them
+    invalidates previously cached pages.
+    """
+    resolution: int = 300
+    lang: str = "eng"
+    min_text_chars: int = 20
+
+    # Adaptive mode: OCR first at a low resolution and only re-render at
+    # `resolution` when the mean word confidence or the recognised
+    # character count falls below the thresholds.
+    adaptive: bool = False
+    adaptive_resolution: int = 150
+    min_confidence: float = 70.0
+
+    # Region mode: on mixed pages (digital stamp over a scanned body) OCR
+    # only the image areas without a text layer, instead of all or nothing.
+    region_ocr: bool = False
+    region_min_area: float = 0.05   # fraction of the page; smaller images (logos, seals) are ignored
+    region_max_text_coverage: float = 0.2   # fraction of an image covered by text lines; above it the image is digital
+
+    # Preprocessing before Tesseract (see preprocess_image): fewer, cleaner
+    # pixels for phone photos and fax-quality scans.
+    preprocess: bool = False
+    preprocess_max_side: int = 3500
+
+    # OCR backend, a key of OCR_ENGINES.
+    engine: str = "pytesseract"
+
+    # PDF text-layer backend and page renderer, keys of PDF_BACKENDS.
+    pdf_backend: str = "pdfplumber"
+    renderer: str = "pdfplumber"
+
+    # Layout mode: on pages with a text layer, also return as structured
+    # rows the table whose header line holds these column labels, in
+    # order (see find_table_rows).
+    table_columns: Optional[Tuple[str, ...]] = None
+
+    def fingerprint(self) -> Dict:
+        return {**asdict(self), "engine_version": _engine_class(self.engine).version()}
+
+
+@dataclass(frozen=True)
+class MemoryBudget:
+    """
+    Low-memory mode for very large documents.
+
+    Each page's cached layout objects are released as soon as its text
+    is produced; if the process RSS goes over max_rss_mb the document is
+    reopened to drop parser caches, and extraction fails with
+    OCRExtractionError if that is not enough. With spill_to_disk,
+    extract_text_by_pages keeps page texts in a temporary file instead
+    of in memory.
+    """
+    max_rss_mb: Optional[int] = None
+    spill_to_disk: bool = False
+
+
+# -------------------------------------------------
+# OCR ENGINES
+# -------------------------------------------------
+class PytesseractEngine:
+    """
+    Default backend: one `tesseract` subprocess per call (temp file +
+    language data reloaded every time). Needs only the tesseract binary.
+    """
+
+    def __init__(self, lang: str):
+        self.lang = lang
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def version() -> str:
+        try:
+            return f"tesseract {pytesseract.get_tesseract_version()}"
+        except Exception:
+            return "tesseract unknown"
+
+    def image_to_string(self, image: Image.Image) -> str:
+        return pytesseract.image_to_string(image, lang=self.lang)
+
+    def image_to_text_with_confidence(self, image: Image.Image) -> Tuple[str, float]:
+        """
+        OCR with image_to_data, returning the text rebuilt line by line and
+        the mean word confidence (0-100, 0 when nothing was recognised).
+        """
+        data = pytesseract.image_to_data(
+            image, lang=self.lang, output_type=pytesseract.Output.DICT
+        )
+
+        lines: Dict[Tuple[int, int, int], List[str]] = {}
+        confidences = []
+
+        for i, word in enumerate(data["text"]):
+            confidence = float(data["conf"][i])
+            if confidence < 0 or not word.strip():
+                continue
+
+            line_key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            lines.setdefault(line_key, []).append(word)
+            confidences.append(confidence)
+
+        text = "\n".join(" ".join(words) for words in lines.values())
+        mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+
+        return text, mean_confidence
+
+
+class TesserocrEngine:
+    """
+    Persistent in-process backend (tesserocr bindings): the Tesseract API
+    and its language data are loaded once per process and fed in-memory
+    PIL images, with no subprocess or temp file per page.
+    """
+
+    def __init__(self, lang: str):
+        if tesserocr is None:
+            raise OCRExtractionError(
+                "OCR engine 'tesserocr' requires the tesserocr package."
+            )
+        self.lang = lang
+        self._api = tesserocr.PyTessBaseAPI(lang=lang)
+        self._lock = threading.Lock()   # the API object is not thread-safe
+
+    @staticmethod
+    @lru_cache(maxsize=1)
+    def version() -> str:
+        if tesserocr is None:
+            return "tesserocr unavailable"
+        return f"tesserocr {tesserocr.tesseract_version().splitlines()[0]}"
+
+    def image_to_string(self, image: Image.Image) -> str:
+        with self._lock:
+            self._api.SetImage(image)
+            return self._api.GetUTF8Text()
+
+    def image_to_text_with_confidence(self, image: Image.Image) -> Tuple[str, float]:
+        with self._lock:
+            self._api.SetImage(image)
+            text = self._api.GetUTF8Text()
+            confidences = [c for c in self._api.AllWordConfidences() if c >= 0]
+
+        mean_confidence = sum(confidences) / len(confidences) if confidences else 0.0
+        return text, float(mean_confidence)
+
+
+OCR_ENGINES = {
+    "pytesseract": PytesseractEngine,
+    "tesserocr": TesserocrEngine,
+}
+
+# Engines are created once per process and language, and reused: worker
+# processes of the parallel mode keep theirs warm across batches.
+_engine_instances: Dict[Tuple[str, str], object] = {}
+_engine_instances_lock = threading.Lock()
+
+
+def _engine_class(name: str):
+    try:
+        return OCR_ENGINES[name]
+    except KeyError:
+        raise OCRExtractionError(f"Unknown OCR engine: {name}")
+
+
+def get_ocr_engine(settings: OCRSettings):
+    """
+    Process-wide engine instance for the settings' backend and language.
+    """
+    key = (settings.engine, settings.lang)
+
+    with _engine_instances_lock:
+        engine = _engine_instances.get(key)
+        if engine is None:
+            engine = _engine_class(settings.engine)(settings.lang)
+            _engine_instances[key] = engine
+
+    return engine
+
+
+def _warm_ocr_engine(settings: OCRSettings) -> None:
+    """
+    Process pool initializer: load the engine before the first page arrives.
+    """
+    try:
+        get_ocr_engine(settings)
+    except Exception as e:
+        logger.warning(f"Could not preload OCR engine '{settings.engine}': {e}")
+
+
 # -------------------------------------------------
 # TEXT CLEANING
 # -------------------------------------------------
@@ -58,69 +299,1129 @@ def is_image(file_path: str) -> bool:
 # PAGE-LEVEL EXTRACTION (MULTI-FACTURA CORE)
 # -------------------------------------------------
 
-def _extract_page_text(page) -> str:
+def _extract_page_text(page: "PdfPage", page_number: int, settings: OCRSettings) -> PageResult:
     """
-    Extract text from a single pdfplumber page.
+    Extract text from a single PDF page.
     Try text layer first, fallback to OCR if needed.
     """
+    if settings.region_ocr:
+        regions = _untexted_image_regions(page.layout, settings)
+        if regions:
+            return _extract_page_regions(page, page_number, regions, settings)
+
     text = page.extract_text()
 
     # Fallback to OCR if text layer is empty or too short
-    if not text or len(text.strip()) < 20:
-        pil_image = page.to_image(resolution=300).original
-        text = pytesseract.image_to_string(pil_image)
+    if text and len(text.strip()) >= settings.min_text_chars:
+        table_rows = None
+        if settings.table_columns:
+            table_rows = find_table_rows(page.layout.extract_words(), settings.table_columns)
+
+        return PageResult(page_number, clean_text(text), method="text", table_rows=table_rows)
+
+    image_hashes = []
 
-    return clean_text(text)
+    def render(resolution: int) -> Image.Image:
+        image = page.render(resolution)
+        if not image_hashes:
+            image_hashes.append(image_fingerprint(image))
+        return image
 
+    text, resolution, confidence = _ocr_rendered(render, f"Page {page_number}", settings)
 
-def extract_text_by_pages(file_path: str) -> List[str]:
+    return PageResult(
+        page_number,
+        clean_text(text),
+        method="ocr",
+        resolution=resolution,
+        confidence=confidence,
+        image_hash=image_hashes[0]
+    )
+
+
+def _ocr_rendered(render, label: str, settings: OCRSettings) -> Tuple[str, int, Optional[float]]:
     """
-    Main function for multi-page extraction.
+    OCR an area rendered by `render(dpi) -> PIL.Image`.
 
-    Returns:
-        List[str] -> One cleaned text string per page.
+    Returns (text, dpi used, mean confidence or None).
+    """
+    if settings.adaptive:
+        pil_image = render(settings.adaptive_resolution)
+        if settings.preprocess:
+            pil_image = preprocess_image(pil_image, settings.preprocess_max_side)
+        text, confidence = get_ocr_engine(settings).image_to_text_with_confidence(pil_image)
+
+        if (confidence >= settings.min_confidence
+                and len(text.strip()) >= settings.min_text_chars):
+            return text, settings.adaptive_resolution, confidence
+
+        logger.info(
+            f"{label}: low OCR quality at {settings.adaptive_resolution} dpi "
+            f"(confidence {confidence:.1f}, {len(text.strip())} chars), "
+            f"escalating to {settings.resolution} dpi"
+        )
+
+    pil_image = render(settings.resolution)
+    if settings.preprocess:
+        pil_image = preprocess_image(pil_image, settings.preprocess_max_side)
+    text = get_ocr_engine(settings).image_to_string(pil_image)
+
+    return text, settings.resolution, None
+
+
+def _extract_page_result(page: "PdfPage", page_number: int, settings: OCRSettings) -> PageResult:
+    """
+    Extract a single page, capturing any error as part of the result.
+    """
+    try:
+        return _extract_page_text(page, page_number, settings)
+    except Exception as e:
+        logger.warning(f"Error extracting page {page_number}: {e}")
+        return PageResult(page_number, "", str(e))
+
+
+def iter_page_results(
+    file_path: str,
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    settings: Optional[OCRSettings] = None,
+    cache: Optional[DiskCache] = None,
+    memory: Optional[MemoryBudget] = None,
+    prefetch: int = 0
+) -> Iterator[PageResult]:
+    """
+    Streaming multi-page extraction: yields each page, in original order,
+    as soon as it is available.
+
+    Args:
+        parallel: Fan page rendering + OCR out across worker processes.
+        workers: Number of worker processes (default: CPU count).
+        settings: OCR settings (default: OCRSettings()).
+        cache: Optional OCR cache; cached pages skip pdfplumber and Tesseract.
+        memory: Optional MemoryBudget enabling the low-memory mode.
+        prefetch: If > 0, extraction runs in a background thread up to this
+            many pages ahead of the consumer, so OCR overlaps with whatever
+            the caller does with each page (e.g. an LLM call).
     """
 
     if not file_path:
         raise OCRExtractionError("File path is empty.")
 
-    if is_pdf(file_path):
-        return _extract_pdf_by_pages(file_path)
+    if not (is_pdf(file_path) or is_image(file_path)):
+        raise OCRExtractionError("Unsupported file type.")
+
+    settings = settings or OCRSettings()
+
+    if cache is not None:
+        results = _iter_cached(file_path, settings, cache, parallel, workers, memory)
+    else:
+        results = _iter_uncached(file_path, settings, parallel, workers, memory)
 
-    elif is_image(file_path):
+    results = _raise_if_all_failed(results)
+
+    if prefetch > 0:
+        results = _prefetch(results, prefetch)
+
+    return results
+
+
+def iter_text_by_pages(
+    file_path: str,
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    settings: Optional[OCRSettings] = None,
+    cache: Optional[DiskCache] = None,
+    memory: Optional[MemoryBudget] = None,
+    prefetch: int = 2
+) -> Iterator[str]:
+    """
+    Streaming counterpart of extract_text_by_pages.
+
+    Yields one cleaned text string per page while the following pages
+    are still being extracted in the background.
+    """
+    results = iter_page_results(
+        file_path,
+        parallel=parallel,
+        workers=workers,
+        settings=settings,
+        cache=cache,
+        memory=memory,
+        prefetch=prefetch
+    )
+
+    for result in results:
+        yield result.text
+
+
+def extract_page_results(
+    file_path: str,
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    settings: Optional[OCRSettings] = None,
+    cache: Optional[DiskCache] = None,
+    memory: Optional[MemoryBudget] = None
+) -> List[PageResult]:
+    """
+    Multi-page extraction with per-page status.
+
+    Returns:
+        List[PageResult] -> One result per page, in original order.
+    """
+    return list(iter_page_results(
+        file_path,
+        parallel=parallel,
+        workers=workers,
+        settings=settings,
+        cache=cache,
+        memory=memory
+    ))
+
+
+def extract_text_by_pages(
+    file_path: str,
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    settings: Optional[OCRSettings] = None,
+    cache: Optional[DiskCache] = None,
+    memory: Optional[MemoryBudget] = None
+) -> Sequence:
+    """
+    Main function for multi-page extraction.
+
+    Pages that fail are returned as empty strings (see extract_page_results
+    for the per-page errors).
+
+    Returns:
+        List[str] -> One cleaned text string per page
+        (a disk-backed SpilledPages sequence with memory.spill_to_disk).
+    """
+    results = iter_page_results(
+        file_path,
+        parallel=parallel,
+        workers=workers,
+        settings=settings,
+        cache=cache,
+        memory=memory
+    )
+
+    if memory is not None and memory.spill_to_disk:
+        return SpilledPages(result.text for result in results)
+
+    return [result.text for result in results]
+
+
+def summarize_page_results(results: List[PageResult]) -> Dict:
+    """
+    Aggregate how pages were extracted (text layer vs OCR, final dpi,
+    mean confidence) to tune the adaptive thresholds on a real corpus.
+    """
+    by_resolution: Dict[int, int] = {}
+    confidences = []
+
+    for result in results:
+        if result.resolution is not None:
+            by_resolution[result.resolution] = by_resolution.get(result.resolution, 0) + 1
+        if result.confidence is not None:
+            confidences.append(result.confidence)
+
+    return {
+        "pages": len(results),
+        "text_layer": sum(1 for r in results if r.method == "text"),
+        "ocr": sum(1 for r in results if r.method == "ocr"),
+        "regions": sum(1 for r in results if r.method == "regions"),
+        "errors": sum(1 for r in results if r.error),
+        "from_cache": sum(1 for r in results if r.from_cache),
+        "ocr_by_resolution": by_resolution,
+        "mean_confidence": sum(confidences) / len(confidences) if confidences else None,
+    }
+
+
+def _iter_uncached(
+    file_path: str,
+    settings: OCRSettings,
+    parallel: bool,
+    workers: Optional[int],
+    memory: Optional[MemoryBudget] = None,
+    page_numbers: Optional[List[int]] = None
+) -> Iterator[PageResult]:
+
+    if is_image(file_path):
         # Image = single "page"
-        text = _extract_image(file_path)
-        return [clean_text(text)]
+        text = _extract_image(file_path, settings)
+        yield PageResult(1, clean_text(text), method="ocr")
+        return
 
+    if parallel:
+        yield from _iter_pdf_parallel(file_path, settings, workers, memory, page_numbers)
     else:
-        raise OCRExtractionError("Unsupported file type.")
+        yield from _iter_pdf_by_pages(file_path, settings, memory, page_numbers)
+
+
+def _raise_if_all_failed(results: Iterator[PageResult]) -> Iterator[PageResult]:
+    """
+    Raise once the document is exhausted if no page could be extracted at all.
+    """
+    first_error = None
+    any_ok = False
+
+    for result in results:
+        if result.error:
+            first_error = first_error or result.error
+        else:
+            any_ok = True
+        yield result
+
+    if first_error and not any_ok:
+        raise OCRExtractionError(
+            f"Error extracting PDF: every page failed ({first_error})"
+        )
+
+
+_PREFETCH_DONE = object()
+
+
+def _prefetch(results: Iterator[PageResult], size: int) -> Iterator[PageResult]:
+    """
+    Run a page iterator in a background thread, buffering up to `size` pages.
+
+    Tesseract runs as a subprocess and LLM calls wait on the network, so
+    both sides release the GIL and genuinely overlap.
+    """
+    buffer: queue.Queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def producer():
+        try:
+            for result in results:
+                if not put(result):
+                    return
+            put(_PREFETCH_DONE)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=producer, name="ocr-prefetch", daemon=True)
+    thread.start()
+
+    try:
+        while True:
+            item = buffer.get()
+            if item is _PREFETCH_DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+# -------------------------------------------------
+# OCR CACHE
+# -------------------------------------------------
+def _page_cache_key(file_hash: str, page_number: int, settings: OCRSettings) -> str:
+    return make_key("ocr-page", file_hash, page_number, settings.fingerprint())
+
+
+def _page_count_cache_key(file_hash: str) -> str:
+    return make_key("ocr-page-count", file_hash)
+
+
+def _cache_entry(result: PageResult) -> str:
+    return json.dumps({
+        "text": result.text,
+        "method": result.method,
+        "resolution": result.resolution,
+        "confidence": result.confidence,
+        "image_hash": result.image_hash,
+        "table_rows": result.table_rows,
+    }, ensure_ascii=False)
+
+
+def _result_from_cache(page_number: int, entry: Dict) -> PageResult:
+    return PageResult(
+        page_number,
+        entry["text"],
+        from_cache=True,
+        method=entry.get("method"),
+        resolution=entry.get("resolution"),
+        confidence=entry.get("confidence"),
+        image_hash=entry.get("image_hash"),
+        table_rows=entry.get("table_rows")
+    )
+
+
+def _iter_cached(
+    file_path: str,
+    settings: OCRSettings,
+    cache: DiskCache,
+    parallel: bool,
+    workers: Optional[int],
+    memory: Optional[MemoryBudget] = None
+) -> Iterator[PageResult]:
+    """
+    Serve pages from the cache and extract only the missing ones.
+
+    The page count is cached under its own document-level key and every
+    page is looked up independently, so a fully cached document never has
+    to be opened and losing one page entry (LRU eviction, extraction
+    error) only re-extracts that page.
+    """
+    try:
+        file_hash = file_sha256(file_path)
+    except OSError as e:
+        raise OCRExtractionError(f"Error reading file: {e}")
+
+    count_key = _page_count_cache_key(file_hash)
+    raw_count = cache.get(count_key)
+
+    if raw_count is not None:
+        page_count = int(raw_count)
+    else:
+        page_count = 1 if is_image(file_path) else _count_pdf_pages(file_path, settings)
+        cache.set(count_key, str(page_count))
+
+    cached: Dict[int, PageResult] = {}
+
+    for page_number in range(1, page_count + 1):
+        raw = cache.get(_page_cache_key(file_hash, page_number, settings))
+        if raw is not None:
+            cached[page_number] = _result_from_cache(page_number, json.loads(raw))
+
+    missing = [n for n in range(1, page_count + 1) if n not in cached]
+    fresh = (
+        _iter_uncached(file_path, settings, parallel, workers, memory, missing)
+        if missing else iter(())
+    )
+
+    for page_number in range(1, page_count + 1):
+        if page_number in cached:
+            yield cached[page_number]
+            continue
+
+        result = next(fresh)
+        if not result.error:
+            cache.set(
+                _page_cache_key(file_hash, result.page_number, settings),
+                _cache_entry(result)
+            )
+        yield result
+
+
+# -------------------------------------------------
+# PDF BACKENDS
+# -------------------------------------------------
+BBox = Tuple[float, float, float, float]  # (x0, top, x1, bottom), in PDF points
+
+
+class PdfplumberBackend:
+    """
+    Default backend (pure Python). Also provides the character/image
+    layout used by region OCR.
+    """
+
+    def __init__(self, file_path: str):
+        self._pdf = pdfplumber.open(file_path)
+
+    def page_count(self) -> int:
+        return len(self._pdf.pages)
+
+    def extract_text(self, index: int) -> str:
+        return self._pdf.pages[index].extract_text()
+
+    def layout_page(self, index: int):
+        return self._pdf.pages[index]
+
+    def release(self, index: int) -> None:
+        # Drops the page's cached chars/objects/layout
+        self._pdf.pages[index].close()
+
+    def render(self, index: int, resolution: int, bbox: Optional[BBox] = None) -> Image.Image:
+        page = self._pdf.pages[index]
+        if bbox is not None:
+            page = page.crop(bbox)
+        return page.to_image(resolution=resolution).original
+
+    def close(self) -> None:
+        self._pdf.close()
+
+
+class PdfiumBackend:
+    """
+    PDFium (C++) backend: much faster text extraction and rendering on
+    large born-digital documents. The document stays open, so pages are
+    not re-parsed for every render as with pdfplumber's to_image.
+
+    Text comes out in content-stream order, which may differ from
+    pdfplumber's top-to-bottom layout order.
+    """
+
+    def __init__(self, file_path: str):
+        self._pdf = pypdfium2.PdfDocument(file_path)
+
+    def page_count(self) -> int:
+        return len(self._pdf)
+
+    def extract_text(self, index: int) -> str:
+        page = self._pdf[index]
+        textpage = page.get_textpage()
+        try:
+            return textpage.get_text_range()
+        finally:
+            textpage.close()
+            page.close()
+
+    def layout_page(self, index: int):
+        return None
+
+    def release(self, index: int) -> None:
+        pass  # pages are opened and closed on every call
+
+    def render(self, index: int, resolution: int, bbox: Optional[BBox] = None) -> Image.Image:
+        page = self._pdf[index]
+        try:
+            crop = (0, 0, 0, 0)
+            if bbox is not None:
+                width, height = page.get_size()
+                x0, top, x1, bottom = bbox
+                crop = (x0, height - bottom, width - x1, top)  # left, bottom, right, top margins
+
+            bitmap = page.render(scale=resolution / 72, crop=crop)
+            return bitmap.to_pil()
+        finally:
+            page.close()
+
+    def close(self) -> None:
+        self._pdf.close()
+
+
+PDF_BACKENDS = {
+    "pdfplumber": PdfplumberBackend,
+    "pypdfium2": PdfiumBackend,
+}
+
+
+class PdfDocument:
+    """
+    A PDF opened with the text backend and renderer chosen in the settings.
+    Extra backends (renderer, pdfplumber layout for region OCR) are only
+    opened when actually needed.
+    """
+
+    def __init__(self, file_path: str, settings: OCRSettings):
+        for name in (settings.pdf_backend, settings.renderer):
+            if name not in PDF_BACKENDS:
+                raise OCRExtractionError(f"Unknown PDF backend: {name}")
+
+        self._file_path = file_path
+        self._backends: Dict[str, object] = {}
+        self.settings = settings
+        self.text_backend = self._backend(settings.pdf_backend)
+
+    def _backend(self, name: str):
+        if name not in self._backends:
+            self._backends[name] = PDF_BACKENDS[name](self._file_path)
+        return self._backends[name]
+
+    def page_count(self) -> int:
+        return self.text_backend.page_count()
+
+    def page(self, number: int) -> "PdfPage":
+        return PdfPage(self, number - 1)
+
+    def release(self, number: int) -> None:
+        """Free the cached layout objects of a finished page."""
+        for backend in self._backends.values():
+            backend.release(number - 1)
+
+    def reopen(self) -> None:
+        """Close every backend so document-level parser caches are dropped."""
+        self.close()
+        self._backends = {}
+        self.text_backend = self._backend(self.settings.pdf_backend)
+
+    def close(self) -> None:
+        for backend in self._backends.values():
+            backend.close()
+
+    def __enter__(self) -> "PdfDocument":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class PdfPage:
+    """
+    One page of a PdfDocument, as seen by the page-level extraction code.
+    """
+
+    def __init__(self, document: PdfDocument, index: int):
+        self._document = document
+        self._index = index
+
+    def extract_text(self) -> str:
+        return self._document.text_backend.extract_text(self._index)
+
+    def render(self, resolution: int, bbox: Optional[BBox] = None) -> Image.Image:
+        renderer = self._document._backend(self._document.settings.renderer)
+        return renderer.render(self._index, resolution, bbox)
+
+    @property
+    def layout(self):
+        """pdfplumber page (chars, images, text lines) for region OCR."""
+        return self._document._backend("pdfplumber").layout_page(self._index)
 
 
 # -------------------------------------------------
 # PDF HANDLING
 # -------------------------------------------------
-def _extract_pdf_by_pages(file_path: str) -> List[str]:
-    pages_text = []
+def _iter_pdf_by_pages(
+    file_path: str,
+    settings: OCRSettings,
+    memory: Optional[MemoryBudget] = None,
+    page_numbers: Optional[List[int]] = None
+) -> Iterator[PageResult]:
 
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for page_number, page in enumerate(pdf.pages, start=1):
-                text = _extract_page_text(page)
-                pages_text.append(text)
+        with PdfDocument(file_path, settings) as pdf:
+            if page_numbers is None:
+                page_numbers = range(1, pdf.page_count() + 1)
+
+            for page_number in page_numbers:
+                result = _extract_page_result(pdf.page(page_number), page_number, settings)
+
+                if memory is not None:
+                    pdf.release(page_number)
+                    _enforce_memory_budget(pdf, memory, page_number)
 
+                yield result
+
+    except OCRExtractionError:
+        raise
+    except Exception as e:
+        raise OCRExtractionError(f"Error extracting PDF: {e}")
+
+
+def _count_pdf_pages(file_path: str, settings: OCRSettings) -> int:
+    try:
+        with PdfDocument(file_path, settings) as pdf:
+            return pdf.page_count()
+    except OCRExtractionError:
+        raise
     except Exception as e:
         raise OCRExtractionError(f"Error extracting PDF: {e}")
 
-    return pages_text
+
+def _extract_pdf_page_batch(
+    file_path: str,
+    page_numbers: List[int],
+    settings: OCRSettings,
+    memory: Optional[MemoryBudget] = None
+) -> List[PageResult]:
+    """
+    Worker entry point: each process opens its own copy of the PDF
+    (page objects cannot be pickled) and extracts a batch of pages.
+    """
+    return list(_iter_pdf_by_pages(file_path, settings, memory, page_numbers))
+
+
+def _iter_pdf_parallel(
+    file_path: str,
+    settings: OCRSettings,
+    workers: Optional[int] = None,
+    memory: Optional[MemoryBudget] = None,
+    page_numbers: Optional[List[int]] = None
+) -> Iterator[PageResult]:
+    workers = workers or os.cpu_count() or 1
+
+    if page_numbers is None:
+        page_numbers = list(range(1, _count_pdf_pages(file_path, settings) + 1))
+
+    # Several small batches per worker keep the load balanced
+    # without reopening the PDF for every page.
+    batch_size = max(1, math.ceil(len(page_numbers) / (workers * 4)))
+    batches = [
+        page_numbers[start:start + batch_size]
+        for start in range(0, len(page_numbers), batch_size)
+    ]
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_warm_ocr_engine,
+            initargs=(settings,)
+        ) as executor:
+            futures = [
+                executor.submit(_extract_pdf_page_batch, file_path, batch, settings, memory)
+                for batch in batches
+            ]
+
+            # Batches are consumed in submission order, so pages come out
+            # in their original order while later batches keep running.
+            for batch, future in zip(batches, futures):
+                try:
+                    batch_results = future.result()
+                except Exception as e:
+                    logger.warning(f"Error extracting pages {batch[0]}-{batch[-1]}: {e}")
+                    batch_results = [PageResult(number, "", str(e)) for number in batch]
+
+                yield from batch_results
+
+    except OCRExtractionError:
+        raise
+    except Exception as e:
+        raise OCRExtractionError(f"Error extracting PDF: {e}")
+
+
+# -------------------------------------------------
+# MEMORY BUDGET
+# -------------------------------------------------
+def current_rss_mb() -> Optional[float]:
+    """
+    Resident memory of this process in MB (None if it cannot be measured).
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / (1024 * 1024)
+
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _enforce_memory_budget(pdf: PdfDocument, memory: MemoryBudget, page_number: int) -> None:
+    if memory.max_rss_mb is None:
+        return
+
+    rss = current_rss_mb()
+    if rss is None or rss <= memory.max_rss_mb:
+        return
+
+    logger.info(
+        f"RSS {rss:.0f} MB over budget ({memory.max_rss_mb} MB) after page "
+        f"{page_number}: reopening document to drop parser caches"
+    )
+    pdf.reopen()
+    gc.collect()
+
+    rss = current_rss_mb()
+    if rss is not None and rss > memory.max_rss_mb:
+        raise OCRExtractionError(
+            f"Memory budget exceeded: {rss:.0f} MB > {memory.max_rss_mb} MB "
+            f"at page {page_number}"
+        )
+
+
+class SpilledPages(Sequence):
+    """
+    Read-only sequence of page texts stored in a temporary file, so only
+    the page being read is held in memory.
+    """
+
+    def __init__(self, texts: Iterator[str]):
+        self._file = tempfile.TemporaryFile()
+        self._offsets: List[Tuple[int, int]] = []
+
+        for text in texts:
+            data = text.encode("utf-8")
+            self._offsets.append((self._file.tell(), len(data)))
+            self._file.write(data)
+
+        self._file.flush()
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        offset, size = self._offsets[index]
+        self._file.seek(offset)
+        return self._file.read(size).decode("utf-8")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+# -------------------------------------------------
+# REGION-LEVEL OCR (MIXED TEXT LAYER / SCANNED PAGES)
+# -------------------------------------------------
+TEXT_MASK_PADDING = 1.0  # points blanked around each text-layer line before region OCR
+
+
+def _line_box(line: Dict) -> BBox:
+    return (line["x0"], line["top"], line["x1"], line["bottom"])
+
+
+def _overlap_area(a: BBox, b: BBox) -> float:
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    return max(width, 0) * max(height, 0)
+
+
+def _untexted_image_regions(page, settings: OCRSettings) -> List[BBox]:
+    """
+    Image areas of a pdfplumber page that are mostly not covered by text
+    layer lines, i.e. scanned content that only OCR can read.
+
+    Images are judged by the fraction of their area under text lines, not
+    by the characters they contain: a full-page scan with a one-line
+    digital stamp still counts as scanned, while a searchable PDF (scan
+    with an invisible OCR text layer) does not.
+    """
+    page_x0, page_top, page_x1, page_bottom = page.bbox
+    page_area = (page_x1 - page_x0) * (page_bottom - page_top)
+    regions: List[BBox] = []
+    line_boxes = None
+
+    for image in page.images:
+        bbox = (
+            max(image["x0"], page_x0),
+            max(image["top"], page_top),
+            min(image["x1"], page_x1),
+            min(image["bottom"], page_bottom),
+        )
+
+        area = max(bbox[2] - bbox[0], 0) * max(bbox[3] - bbox[1], 0)
+        if area < settings.region_min_area * page_area or bbox in regions:
+            continue
+
+        if line_boxes is None:
+            line_boxes = [_line_box(line) for line in page.extract_text_lines()]
+
+        covered = sum(_overlap_area(box, bbox) for box in line_boxes)
+        if covered < settings.region_max_text_coverage * area:
+            regions.append(bbox)
+
+    return regions
+
+
+def _mask_text_lines(image: Image.Image, bbox: BBox, line_boxes: List[BBox]) -> Image.Image:
+    """
+    Blank out the text-layer lines that fall on a rendered region, so OCR
+    only reads the scanned content and the lines are not read twice.
+    """
+    scale_x = image.width / (bbox[2] - bbox[0])
+    scale_y = image.height / (bbox[3] - bbox[1])
+    draw = ImageDraw.Draw(image)
+
+    for box in line_boxes:
+        if _overlap_area(box, bbox) == 0:
+            continue
+        draw.rectangle(
+            (
+                (box[0] - TEXT_MASK_PADDING - bbox[0]) * scale_x,
+                (box[1] - TEXT_MASK_PADDING - bbox[1]) * scale_y,
+                (box[2] + TEXT_MASK_PADDING - bbox[0]) * scale_x,
+                (box[3] + TEXT_MASK_PADDING - bbox[1]) * scale_y,
+            ),
+            fill="white"
+        )
+
+    return image
+
+
+def _extract_page_regions(
+    page: "PdfPage",
+    page_number: int,
+    regions: List[BBox],
+    settings: OCRSettings
+) -> PageResult:
+    """
+    Keep the text layer as it is, OCR the untexted image regions with the
+    text lines blanked out, and merge both in reading order
+    (top-to-bottom, left-to-right).
+    """
+    lines = page.layout.extract_text_lines()
+    line_boxes = [_line_box(line) for line in lines]
+    segments = [(line["top"], line["x0"], line["text"]) for line in lines]  # (top, x0, text)
+
+    resolutions = []
+    confidences = []
+
+    for index, bbox in enumerate(regions, start=1):
+        text, resolution, confidence = _ocr_rendered(
+            lambda dpi, bbox=bbox: _mask_text_lines(page.render(dpi, bbox), bbox, line_boxes),
+            f"Page {page_number} region {index}",
+            settings
+        )
+
+        segments.append((bbox[1], bbox[0], text))
+        resolutions.append(resolution)
+        if confidence is not None:
+            confidences.append(confidence)
+
+    segments.sort(key=lambda segment: (segment[0], segment[1]))
+    text = "\n".join(segment[2] for segment in segments if segment[2].strip())
+
+    return PageResult(
+        page_number,
+        clean_text(text),
+        method="regions",
+        resolution=max(resolutions),
+        confidence=min(confidences) if confidences else None
+    )
+
+
+# -------------------------------------------------
+# TABLE LAYOUT (BORN-DIGITAL PAGES)
+# -------------------------------------------------
+def _group_lines(words: List[Dict], tolerance: float) -> List[List[Dict]]:
+    """
+    Group pdfplumber words into visual lines (same `top` within tolerance),
+    top to bottom and left to right.
+    """
+    lines = []
+
+    for word in sorted(words, key=lambda w: (w["top"], w["x0"])):
+        if lines and abs(word["top"] - lines[-1][0]["top"]) <= tolerance:
+            lines[-1].append(word)
+        else:
+            lines.append([word])
+
+    return [sorted(line, key=lambda w: w["x0"]) for line in lines]
+
+
+def _header_spans(line: List[Dict], columns: Sequence[str]) -> Optional[List[Tuple[float, float]]]:
+    """
+    (x0, x1) of each column label in a header line, or None if the line
+    does not contain all the labels in order. Labels may span several words.
+    """
+    texts = [w["text"].casefold() for w in line]
+    spans = []
+    start = 0
+
+    for label in columns:
+        tokens = label.casefold().split()
+        for i in range(start, len(texts) - len(tokens) + 1):
+            if texts[i:i + len(tokens)] == tokens:
+                spans.append((line[i]["x0"], line[i + len(tokens) - 1]["x1"]))
+                start = i + len(tokens)
+                break
+        else:
+            return None
+
+    return spans
+
+
+def find_table_rows(
+    words: List[Dict],
+    columns: Sequence[str],
+    line_tolerance: float = 3.0
+) -> Optional[List[Dict[str, str]]]:
+    """
+    Rebuild a table from word coordinates (pdfplumber extract_words).
+
+    The header is the first line holding all `columns` labels in order.
+    Column boundaries are the midpoints between consecutive header labels,
+    and each word goes to the column containing its horizontal center, so
+    left-aligned text and right-aligned numbers both land under their
+    header. Rows are the lines below the header up to the first one with
+    an empty first column (totals, next section).
+
+    Returns a list of {label: cell text} dicts, or None if no header matches.
+    """
+    lines = _group_lines(words, line_tolerance)
+
+    for header_index, line in enumerate(lines):
+        spans = _header_spans(line, columns)
+        if spans is not None:
+            break
+    else:
+        return None
+
+    boundaries = [
+        (spans[i][1] + spans[i + 1][0]) / 2
+        for i in range(len(spans) - 1)
+    ]
+
+    rows = []
+    for line in lines[header_index + 1:]:
+        cells = [[] for _ in columns]
+        for word in line:
+            center = (word["x0"] + word["x1"]) / 2
+            column = sum(1 for boundary in boundaries if center >= boundary)
+            cells[column].append(word["text"])
+
+        if not cells[0]:
+            break
+
+        rows.append({label: " ".join(cell) for label, cell in zip(columns, cells)})
+
+    return rows
+
+
+# -------------------------------------------------
+# IMAGE PREPROCESSING
+# -------------------------------------------------
+DENOISE_WINDOW = 3            # box blur (px) applied before thresholding
+BINARIZE_WINDOW = 31          # local window (px) for adaptive thresholding
+BINARIZE_OFFSET = 0.15        # pixel is ink if darker than (1 - offset) * local mean
+DESKEW_MAX_ANGLE = 5.0        # degrees searched on each side
+DESKEW_STEP = 0.25
+DESKEW_SAMPLE = 200_000       # ink pixels sampled to score each angle
+MARGIN_PADDING = 10           # px kept around the content after cropping
+
+
+def preprocess_image(image: Image.Image, max_side: int = 3500) -> Image.Image:
+    """
+    Prepare an image for Tesseract using vectorised NumPy operations:
+    grayscale, downscale of oversized images, adaptive binarisation,
+    deskew and margin cropping.
+
+    Returns a binary ("L" mode, 0/255) image, usually much smaller than
+    the input, so Tesseract has fewer and cleaner pixels to process.
+    """
+    image = _downscale(image, max_side)
+    gray = _to_grayscale(image)
+    ink = _adaptive_binarize(gray)
+
+    angle = _estimate_skew(ink)
+    if angle:
+        ink = np.asarray(
+            Image.fromarray(ink.astype(np.uint8) * 255).rotate(
+                -angle, resample=Image.NEAREST, expand=True, fillcolor=0
+            )
+        ) > 127
+
+    ink = _crop_margins(ink)
+
+    # Tesseract expects dark text on a light background
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8), mode="L")
+
+
+def _downscale(image: Image.Image, max_side: int) -> Image.Image:
+    longest = max(image.size)
+    if longest <= max_side:
+        return image
+
+    scale = max_side / longest
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def _to_grayscale(image: Image.Image) -> np.ndarray:
+    if image.mode == "L":
+        return np.asarray(image, dtype=np.float32)
+
+    rgb = np.asarray(image.convert("RGB"), dtype=np.float32)
+    return rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def _box_mean(gray: np.ndarray, window: int) -> np.ndarray:
+    """
+    Mean over a window x window neighbourhood of every pixel, computed
+    with an integral image (cost independent of the window size).
+    """
+    height, width = gray.shape
+    half = window // 2
+
+    integral = np.zeros((height + 1, width + 1), dtype=np.float64)
+    integral[1:, 1:] = gray.cumsum(axis=0, dtype=np.float64).cumsum(axis=1)
+
+    rows = np.arange(height)
+    cols = np.arange(width)
+    top = np.clip(rows - half, 0, height)[:, None]
+    bottom = np.clip(rows + half + 1, 0, height)[:, None]
+    left = np.clip(cols - half, 0, width)[None, :]
+    right = np.clip(cols + half + 1, 0, width)[None, :]
+
+    window_sum = (
+        integral[bottom, right] - integral[top, right]
+        - integral[bottom, left] + integral[top, left]
+    )
+    return (window_sum / ((bottom - top) * (right - left))).astype(np.float32)
+
+
+def _adaptive_binarize(gray: np.ndarray) -> np.ndarray:
+    """
+    Bradley-style local mean thresholding, robust to uneven lighting in
+    phone photos. A light blur first keeps scanner/fax speckle out of
+    the result. Returns True where there is ink.
+    """
+    denoised = _box_mean(gray, DENOISE_WINDOW)
+    local_mean = _box_mean(denoised, BINARIZE_WINDOW)
+
+    return denoised < local_mean * (1 - BINARIZE_OFFSET)
+
+
+def _estimate_skew(ink: np.ndarray) -> float:
+    """
+    Projection-profile deskew: the angle whose sheared row histogram is
+    the sharpest (text lines aligned with rows). All candidate angles are
+    scored at once on a sample of ink pixel coordinates.
+    """
+    ys, xs = np.nonzero(ink)
+    if len(ys) == 0:
+        return 0.0
+
+    if len(ys) > DESKEW_SAMPLE:
+        sample = np.random.default_rng(0).choice(len(ys), DESKEW_SAMPLE, replace=False)
+        ys, xs = ys[sample], xs[sample]
+
+    angles = np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + DESKEW_STEP / 2, DESKEW_STEP)
+    slopes = np.tan(np.radians(angles))
+
+    # Row each ink pixel would fall on after rotating by each angle
+    sheared = np.rint(ys[None, :] + xs[None, :] * slopes[:, None]).astype(np.int64)
+    sheared -= sheared.min()
+
+    n_rows = int(sheared.max()) + 1
+    offsets = (np.arange(len(angles)) * n_rows)[:, None]
+    histograms = np.bincount((sheared + offsets).ravel(), minlength=len(angles) * n_rows)
+    scores = (histograms.reshape(len(angles), n_rows).astype(np.float64) ** 2).sum(axis=1)
+
+    return float(angles[int(np.argmax(scores))])
+
+
+def _crop_margins(ink: np.ndarray) -> np.ndarray:
+    rows = np.flatnonzero(ink.any(axis=1))
+    cols = np.flatnonzero(ink.any(axis=0))
+
+    if len(rows) == 0 or len(cols) == 0:
+        return ink
+
+    top = max(rows[0] - MARGIN_PADDING, 0)
+    bottom = min(rows[-1] + MARGIN_PADDING + 1, ink.shape[0])
+    left = max(cols[0] - MARGIN_PADDING, 0)
+    right = min(cols[-1] + MARGIN_PADDING + 1, ink.shape[1])
+
+    return ink[top:bottom, left:right]
+
+
+def image_fingerprint(image: Image.Image, hash_size: int = 8) -> str:
+    """
+    Perceptual difference hash (dHash) of an image as a hex string.
+    Two scans of the same page give hashes within a few bits of each other.
+    """
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+
+    return f"{int(''.join('1' if bit else '0' for bit in bits), 2):0{hash_size * hash_size // 4}x}"
 
 
 # -------------------------------------------------
 # IMAGE HANDLING
 # -------------------------------------------------
-def _extract_image(file_path: str) -> str:
+def _extract_image(file_path: str, settings: OCRSettings) -> str:
     try:
         with Image.open(file_path) as img:
-            text = pytesseract.image_to_string(img)
+            if settings.preprocess:
+                img = preprocess_image(img, settings.preprocess_max_side)
+            text = get_ocr_engine(settings).image_to_string(img)
             return text or ""
     except Exception as e:
         raise OCRExtractionError(f"Error performing OCR on image: {e}")
@@ -0,0 +1,112 @@
+"""
+page_dedup.py
+
+Detección de páginas duplicadas entre ocr.py y envoice_processor.py.
+
+Las subidas masivas de facturas suelen repetir páginas (escaneadas dentro
+de un lote y también sueltas). Cada página se identifica por:
+- Hash del texto normalizado (clean_text + minúsculas + espacios).
+- Hash perceptual de la imagen renderizada, cuando la página pasó por OCR
+  (dos escaneos de la misma hoja dan textos OCR algo distintos). Como dos
+  facturas distintas de la misma plantilla tienen casi la misma imagen,
+  además deben coincidir todas las cifras del texto (importes, fechas,
+  números de factura); ante la duda la página se trata como nueva.
+
+Así la extracción LLM de la primera copia se reutiliza para las demás.
+"""
+
+import hashlib
+import re
+from typing import Dict, List, Optional, Tuple
+
+from ocr import clean_text
+
+
+# Bits distintos tolerados entre hashes perceptuales de 64 bits
+MAX_IMAGE_HASH_DISTANCE = 4
+
+
+def text_fingerprint(text: str) -> str:
+    """
+    Hash del texto normalizado: insensible a mayúsculas, espacios y saltos de línea.
+    """
+    normalized = re.sub(r"\s+", " ", clean_text(text)).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def numbers_fingerprint(text: str) -> str:
+    """
+    Hash de la secuencia de cifras del texto, que distingue facturas
+    de la misma plantilla aunque su imagen sea casi idéntica.
+    """
+    numbers = re.findall(r"\d+", text)
+    return hashlib.sha256(" ".join(numbers).encode("utf-8")).hexdigest()
+
+
+def page_text_and_hash(page) -> Tuple[str, Optional[str]]:
+    """
+    Acepta tanto el texto de la página como un ocr.PageResult.
+    """
+    if isinstance(page, str):
+        return page, None
+    return page.text, getattr(page, "image_hash", None)
+
+
+def _hamming(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+
+class PageDeduplicator:
+    """
+    Registro incremental de páginas vistas; funciona también en streaming.
+    """
+
+    def __init__(self, max_image_distance: int = MAX_IMAGE_HASH_DISTANCE):
+        self.max_image_distance = max_image_distance
+        self._by_text: Dict[str, int] = {}
+        self._image_hashes: List[Tuple[str, str, int]] = []
+
+    def check(self, page_number: int, text: str, image_hash: Optional[str] = None) -> Optional[int]:
+        """
+        Devuelve el número de la primera página idéntica ya vista,
+        o None (y registra la página) si es nueva.
+        """
+        fingerprint = text_fingerprint(text)
+
+        original = self._by_text.get(fingerprint)
+        if original is not None:
+            return original
+
+        numbers = numbers_fingerprint(text)
+
+        if image_hash:
+            for seen_hash, seen_numbers, seen_page in self._image_hashes:
+                if (seen_numbers == numbers
+                        and _hamming(image_hash, seen_hash) <= self.max_image_distance):
+                    return seen_page
+
+        self._by_text[fingerprint] = page_number
+        if image_hash:
+            self._image_hashes.append((image_hash, numbers, page_number))
+
+        return None
+
+
+def find_duplicate_pages(pages) -> Dict[int, int]:
+    """
+    Para una lista de páginas (texto o PageResult), devuelve
+    {página duplicada: página original}, numerando desde 1.
+    """
+    dedup = PageDeduplicator()
+    duplicates = {}
+
+    for page_number, page in enumerate(pages, start=1):
+        text, image_hash = page_text_and_hash(page)
+        if not text.strip():
+            continue
+
+        original = dedup.check(page_number, text, image_hash)
+        if original is not None:
+            duplicates[page_number] = original
+
+    return duplicates
@@ -0,0 +1,113 @@
+"""
+Benchmark de memoria de ocr.py sobre un PDF sintético grande.
+
+Genera una "escritura" de N páginas con capa de texto densa y mide el
+pico de RSS de extract_text_by_pages con y sin ocr.MemoryBudget, cada
+modo en un proceso limpio:
+
+    python -m test.bench_memory            # 200 páginas
+    python -m test.bench_memory 600
+
+Usa el módulo resource, disponible solo en Linux/macOS.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+LINES_PER_PAGE = 60
+
+MODES = {
+    "normal": "None",
+    "low_memory": "MemoryBudget()",
+    "low_memory+spill": "MemoryBudget(spill_to_disk=True)",
+}
+
+
+def write_synthetic_pdf(path: str, pages: int) -> None:
+    """
+    Escribe un PDF mínimo válido (Helvetica, una página de texto por hoja)
+    sin dependencias externas.
+    """
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # Pages, se rellena al final
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+
+    for page in range(1, pages + 1):
+        lines = [b"BT /F1 9 Tf 11 TL 40 800 Td"]
+        for line in range(LINES_PER_PAGE):
+            lines.append(
+                f"({page}.{line + 1}.- Finca urbana vivienda en planta {line}, "
+                f"referencia catastral 9959606YI1895N{page % 10000:04d}XY) '".encode("latin-1")
+            )
+        lines.append(b"ET")
+        stream = b"\n".join(lines)
+
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(f.tell())
+            f.write(b"%d 0 obj\n%s\nendobj\n" % (number, body))
+
+        xref = f.tell()
+        f.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+        for offset in offsets:
+            f.write(b"%010d 00000 n \n" % offset)
+        f.write(
+            b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (len(objects) + 1, xref)
+        )
+
+
+def measure(path: str, memory: str) -> str:
+    """
+    Ejecuta la extracción en un proceso nuevo y devuelve su pico de RSS.
+    """
+    code = (
+        "import resource, sys, time\n"
+        "from ocr import extract_text_by_pages, MemoryBudget\n"
+        "start = time.perf_counter()\n"
+        f"pages = extract_text_by_pages({path!r}, memory={memory})\n"
+        "elapsed = time.perf_counter() - start\n"
+        "peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024\n"
+        "print(f'{len(pages)} páginas  {elapsed:6.1f}s  pico RSS {peak:7.1f} MB')\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True, text=True, check=True
+    )
+    return result.stdout.strip()
+
+
+if __name__ == "__main__":
+    n_pages = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "escritura_sintetica.pdf")
+
+        start = time.perf_counter()
+        write_synthetic_pdf(path, n_pages)
+        print(f"PDF sintético: {n_pages} páginas, "
+              f"{os.path.getsize(path) / 1024 / 1024:.1f} MB "
+              f"({time.perf_counter() - start:.1f}s)")
+
+        for name, memory in MODES.items():
+            print(f"{name:<17} {measure(path, memory)}")
@@ -0,0 +1,57 @@
+"""
+Benchmark de los backends PDF de ocr.py (capa de texto y renderizado).
+
+Mide, para cada PDF de data/ (o las rutas indicadas), el tiempo de
+extracción de la capa de texto y de renderizado a 300 dpi con cada
+backend registrado en ocr.PDF_BACKENDS:
+
+    python -m test.bench_pdf_backends
+    python -m test.bench_pdf_backends escritura.pdf
+"""
+
+import glob
+import sys
+import time
+
+from ocr import PDF_BACKENDS, OCRSettings, PdfDocument
+
+
+def time_text(path: str, backend: str):
+    settings = OCRSettings(pdf_backend=backend)
+    start = time.perf_counter()
+
+    with PdfDocument(path, settings) as pdf:
+        pages = pdf.page_count()
+        chars = sum(len(pdf.page(n).extract_text() or "") for n in range(1, pages + 1))
+
+    return time.perf_counter() - start, pages, chars
+
+
+def time_render(path: str, renderer: str, resolution: int = 300):
+    settings = OCRSettings(renderer=renderer)
+    start = time.perf_counter()
+
+    with PdfDocument(path, settings) as pdf:
+        for n in range(1, pdf.page_count() + 1):
+            pdf.page(n).render(resolution)
+
+    return time.perf_counter() - start
+
+
+def bench(path: str):
+    print(f"\n--- {path} ---")
+
+    for backend in PDF_BACKENDS:
+        elapsed, pages, chars = time_text(path, backend)
+        print(f"Texto  {backend:<11} {elapsed:7.3f}s  ({pages} páginas, {chars} caracteres)")
+
+    for renderer in PDF_BACKENDS:
+        elapsed = time_render(path, renderer)
+        print(f"Render {renderer:<11} {elapsed:7.3f}s  (300 dpi)")
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:] or sorted(glob.glob("data/*.pdf"))
+
+    for path in paths:
+        bench(path)
@@ -0,0 +1,78 @@
+"""
+Benchmark del preprocesado de imagen previo a Tesseract.
+
+Compara, para cada imagen, píxeles y tiempo de OCR con y sin
+ocr.preprocess_image. Sin argumentos genera una página sintética tipo
+fax (ruido, inclinación y márgenes amplios); también acepta rutas a
+imágenes reales:
+
+    python -m test.bench_preprocess foto1.jpg escaneo2.png
+"""
+
+import sys
+import time
+
+import numpy as np
+import pytesseract
+from PIL import Image, ImageDraw, ImageFont
+
+from ocr import preprocess_image
+
+
+def synthetic_fax_page() -> Image.Image:
+    page = Image.new("L", (3400, 4400), 235)
+    draw = ImageDraw.Draw(page)
+    font = ImageFont.load_default(size=42)
+
+    for line in range(45):
+        draw.text(
+            (700, 900 + line * 62),
+            f"{line + 1:>3} 20-08-2014 11:33 Gasol 5 Amado Gestion, S.L 52,84 1,444 1,59 74,71",
+            fill=30,
+            font=font
+        )
+
+    noisy = np.asarray(page, dtype=np.float32)
+    noisy += np.random.default_rng(0).normal(0, 25, noisy.shape)
+    page = Image.fromarray(np.clip(noisy, 0, 255).astype(np.uint8), mode="L")
+
+    return page.rotate(2, expand=True, fillcolor=235)
+
+
+def time_ocr(image: Image.Image):
+    start = time.perf_counter()
+    try:
+        pytesseract.image_to_string(image)
+    except Exception as e:
+        print(f"  OCR no disponible: {e}")
+        return None
+    return time.perf_counter() - start
+
+
+def bench(name: str, image: Image.Image):
+    print(f"\n--- {name} ---")
+
+    start = time.perf_counter()
+    processed = preprocess_image(image)
+    preprocess_time = time.perf_counter() - start
+
+    print(f"Píxeles: {image.width * image.height:,} -> {processed.width * processed.height:,}")
+    print(f"Preprocesado: {preprocess_time:.2f}s")
+
+    before = time_ocr(image)
+    after = time_ocr(processed)
+
+    if before is not None and after is not None:
+        print(f"OCR sin preprocesar: {before:.2f}s")
+        print(f"OCR preprocesado:    {after:.2f}s (+{preprocess_time:.2f}s preprocesado)")
+
+
+if __name__ == "__main__":
+    paths = sys.argv[1:]
+
+    if not paths:
+        bench("Página sintética tipo fax", synthetic_fax_page())
+
+    for path in paths:
+        with Image.open(path) as img:
+            bench(path, img.copy())
@@ -0,0 +1,42 @@
+from inventory_dedup import merge_duplicate_items
+
+
+# Descripción larga (unas 200 palabras distintas, sin cifras): dos plazas que
+# solo difieren en el número comparten casi todos los shingles y caen en los
+# mismos cubos LSH
+WORDS = ("linda", "frente", "zona", "maniobra", "derecha", "muro", "izquierda",
+         "rampa", "acceso", "sotano", "edificio", "calle", "mayor", "valencia")
+BUILDING = " ".join(f"{a}{b}" for a in WORDS for b in WORDS)
+
+
+def garage(number):
+    return {
+        "descripcion": f"URBANA.- Plaza de garaje número {number}. {BUILDING}",
+        "referencias_catastrales": [],
+        "regimen": "ganancial",
+    }
+
+
+def test_exact_duplicate_after_near_duplicate():
+    # Plaza 3, plaza 4 del mismo edificio y otra vez la plaza 4 (adjudicaciones).
+    # Las firmas de las plazas 3 y 4 coinciden en todas las bandas
+    items = [garage(3), garage(4), garage(4)]
+
+    merged, merges = merge_duplicate_items(items)
+
+    assert len(merged) == 2
+    assert [position for position, _ in merges] == [1]
+    assert merges[0][1][0][1] == "descripcion"
+
+
+def test_distinct_garages_are_kept():
+    merged, merges = merge_duplicate_items([garage(3), garage(4), garage(5)])
+
+    assert len(merged) == 3
+    assert merges == []
+
+
+if __name__ == "__main__":
+    test_exact_duplicate_after_near_duplicate()
+    test_distinct_garages_are_kept()
+    print("OK")